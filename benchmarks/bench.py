@@ -0,0 +1,245 @@
+"""Benchmarks config parsing, sql generation and test runs against a generated
+sqlite database.
+
+    python benchmarks/bench.py --models 50 --rows 10000 --output results.json
+
+Every model gets its own table and yaml file, with a mix of the built-in tests. The
+timings of each benchmark are written as json so that versions can be compared.
+"""
+
+import argparse
+from contextlib import redirect_stdout
+import io
+import json
+import os
+from pathlib import Path
+import platform
+import random
+import re
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import time
+from typing import Callable
+
+import sqlalchemy as sa
+import yaml
+
+from sqltest.models import Config, gather_models
+from sqltest.runner import TestRunner
+
+STATUSES = ["A", "I", "P", "X"]
+
+
+def model_obj(name: str) -> dict:
+    """The yaml definition of a generated model"""
+    return {
+        "name": name,
+        "schema": "main",
+        "tests": [{"unique_combination_of_columns": {"columns": ["id", "code"]}}],
+        "columns": [
+            {"name": "id", "tests": ["unique", "not_null"]},
+            {
+                "name": "code",
+                "tests": ["not_null", {"regexp_like": {"expression": "^[A-Z]{3}$"}}],
+            },
+            {
+                "name": "status",
+                "tests": [
+                    {"accepted_values": {"values": STATUSES[:3]}},
+                    {"expression_is_true": {"expression": "length(status) = 1"}},
+                ],
+            },
+            {
+                "name": "amount",
+                "tests": [{"accepted_range": {"min_value": 0, "max_value": 1000}}],
+            },
+            {
+                "name": "parent_id",
+                "tests": [{"relationships": {"to": "main.model_0", "field": "id"}}],
+            },
+        ],
+    }
+
+
+def generate(workdir: Path, models: int, rows: int, seed: int = 0) -> Path:
+    """Creates a sqlite database, model files and a config in `workdir`, returning
+    the config's path"""
+    rng = random.Random(seed)
+    db_path = workdir / "bench.db"
+    models_dir = workdir / "models"
+    models_dir.mkdir(parents=True, exist_ok=True)
+
+    with sqlite3.connect(db_path) as db:
+        for i in range(models):
+            name = f"model_{i}"
+            db.execute(f"drop table if exists {name}")
+            db.execute(
+                f"create table {name} ("
+                "id integer, code text, status text, amount real, parent_id integer)"
+            )
+            db.executemany(
+                f"insert into {name} values (?, ?, ?, ?, ?)",
+                (
+                    (
+                        n,
+                        "".join(rng.choices("ABCDEFGHIJ", k=3)),
+                        rng.choice(STATUSES),
+                        rng.uniform(0, 1100),
+                        rng.randrange(rows),
+                    )
+                    for n in range(rows)
+                ),
+            )
+            with (models_dir / f"{name}.yml").open("w") as f:
+                yaml.safe_dump(model_obj(name), f)
+
+    config = {
+        "source": {"name": "bench", "url": f"sqlite:///{db_path}"},
+        "models_dir": str(models_dir),
+        "target_dir": str(workdir / ".sqltest"),
+    }
+    config_path = workdir / "sqltest.yml"
+    with config_path.open("w") as f:
+        yaml.safe_dump(config, f)
+    return config_path
+
+
+def register_functions(dbapi_connection, connection_record):
+    """Adds the oracle functions the tests use to sqlite"""
+
+    def regexp_like(value, pattern, flags=""):
+        if value is None:
+            return None
+        return re.search(pattern, value, re.I if "i" in flags else 0) is not None
+
+    dbapi_connection.create_function("regexp_like", -1, regexp_like, deterministic=True)
+
+
+def measure(fn: Callable[[], int], repeat: int) -> dict:
+    """Times `fn`, which returns how many items it processed, `repeat` times"""
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        items = fn()
+        runs.append(time.perf_counter() - start)
+    median = statistics.median(runs)
+    return {
+        "items": items,
+        "median": median,
+        "min": min(runs),
+        "runs": runs,
+        "per_second": items / median if median else None,
+    }
+
+
+def run_suite(config_path: Path, **kwargs) -> int:
+    config = Config.from_yaml(config_path)
+    runner = TestRunner(config, cache=False, **kwargs)
+    sa.event.listen(runner.engine, "connect", register_functions)
+    with redirect_stdout(io.StringIO()):
+        result = runner.run()
+    if result.errors:
+        raise RuntimeError(f"{result.errors:,} tests errored")
+    return result.tested
+
+
+def benchmarks(config_path: Path, threads: list[int]) -> dict[str, Callable]:
+    models_dir = config_path.parent / "models"
+    manifest = config_path.parent / ".sqltest" / "manifest.pickle"
+
+    def parse_cold() -> int:
+        manifest.unlink(missing_ok=True)
+        return len(Config.from_yaml(config_path).models)
+
+    def parse_warm() -> int:
+        return len(Config.from_yaml(config_path).models)
+
+    def gather() -> int:
+        return len(gather_models(models_dir))
+
+    runner = TestRunner(Config.from_yaml(config_path))
+    test_cases = runner.gather_test_cases()
+
+    def gather_test_cases() -> int:
+        return len(runner.gather_test_cases())
+
+    def generate_sql() -> int:
+        for test_case in runner.iter_test_cases():
+            test_case.sql
+        return len(test_cases)
+
+    suite = {
+        "parse_cold": parse_cold,
+        "parse_warm": parse_warm,
+        "gather_models": gather,
+        "gather_test_cases": gather_test_cases,
+        "generate_sql": generate_sql,
+    }
+    for n in threads:
+        suite[f"run_threads_{n}"] = lambda n=n: run_suite(config_path, threads=n)
+        suite[f"run_fused_threads_{n}"] = lambda n=n: run_suite(
+            config_path, threads=n, fuse=True
+        )
+    return suite
+
+
+def git_commit() -> str | None:
+    try:
+        output = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.stdout.strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--models", type=int, default=50, help="models to generate")
+    parser.add_argument("--rows", type=int, default=10_000, help="rows per table")
+    parser.add_argument(
+        "--threads", type=int, nargs="+", default=[1, 4], help="thread counts to run"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="runs per benchmark")
+    parser.add_argument(
+        "-k", dest="only", default=None, help="only run benchmarks containing this"
+    )
+    parser.add_argument("--workdir", type=Path, default=None)
+    parser.add_argument("--output", type=Path, default=None, help="json results file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = args.workdir or Path(tmp)
+        config_path = generate(workdir, args.models, args.rows)
+
+        results = {}
+        for name, fn in benchmarks(config_path, args.threads).items():
+            if args.only and args.only not in name:
+                continue
+            results[name] = measure(fn, args.repeat)
+            stats = results[name]
+            print(
+                f"{name:<24} {stats['median']:9.4f}s "
+                f"{stats['per_second']:12,.1f}/s ({stats['items']:,} items)"
+            )
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "sqlalchemy": sa.__version__,
+        "cpus": os.cpu_count(),
+        "params": {"models": args.models, "rows": args.rows, "repeat": args.repeat},
+        "results": results,
+    }
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
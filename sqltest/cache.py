@@ -0,0 +1,126 @@
+import hashlib
+import json
+from pathlib import Path
+import sqlite3
+from textwrap import dedent
+import threading
+import time
+from typing import Any
+
+from sqltest.funcs import Query
+
+
+class ResultCache:
+    """A local store of test results, keyed on the test's sql and a fingerprint of
+    the table it was run against.
+
+    Results are kept in a sqlite database so that they can be shared between runs.
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute(
+            """
+            create table if not exists results (
+              key text primary key,
+              passed integer not null,
+              failures integer,
+              created_at real not null
+            )"""
+        )
+        self._db.commit()
+
+    @staticmethod
+    def key(sql: str, params: dict[str, Any], fingerprint: str) -> str:
+        """Builds the cache key for a test query run against a table fingerprint"""
+        payload = json.dumps([sql, params, fingerprint], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key: str) -> dict | None:
+        """Looks up a stored result, returning None if there isn't one"""
+        with self._lock:
+            row = self._db.execute(
+                "select passed, failures from results where key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"passed": bool(row[0]), "failures": row[1]}
+
+    def put(self, key: str, passed: bool, failures: int | None):
+        """Stores a test result"""
+        with self._lock:
+            self._db.execute(
+                "insert or replace into results values (?, ?, ?, ?)",
+                (key, passed, failures, time.time()),
+            )
+            self._db.commit()
+
+    def evict(self, max_age: float, max_entries: int):
+        """Removes results older than `max_age` seconds, then the oldest results
+        beyond `max_entries`"""
+        with self._lock:
+            self._db.execute(
+                "delete from results where created_at < ?", (time.time() - max_age,)
+            )
+            self._db.execute(
+                """
+                delete from results where key not in (
+                  select key from results order by created_at desc limit ?
+                )""",
+                (max_entries,),
+            )
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+# built-in fingerprints for oracle tables
+FINGERPRINTS = {
+    # changes whenever the table's structure changes
+    "ddl": """\
+        select last_ddl_time
+        from all_objects
+        where
+          owner = upper(:owner) and
+          object_name = upper(:name) and
+          object_type in ('TABLE', 'VIEW', 'MATERIALIZED VIEW')""",
+    # dml tracked by table monitoring, which is flushed to the dictionary periodically
+    "modifications": """\
+        select
+          o.last_ddl_time,
+          m.inserts,
+          m.updates,
+          m.deletes,
+          m.truncated,
+          m.timestamp
+        from all_objects o
+          left join all_tab_modifications m on
+            m.table_owner = o.owner and
+            m.table_name = o.object_name and
+            m.partition_name is null
+        where
+          o.owner = upper(:owner) and
+          o.object_name = upper(:name) and
+          o.object_type = 'TABLE'""",
+    # exact, but reads the whole table
+    "rowscn": "select max(ora_rowscn) from {schema}.{name}",
+}
+
+
+def fingerprint_query(schema: str, name: str, fingerprint: str) -> Query:
+    """The query used to fingerprint a table.
+
+    `fingerprint` is either the name of a built-in fingerprint or a query of the
+    user's own, which may refer to the table as `{schema}.{name}`.
+    """
+    sql = FINGERPRINTS.get(fingerprint, fingerprint)
+    sql = dedent(sql).format(schema=schema, name=name)
+    params = {
+        k: v for k, v in {"owner": schema, "name": name}.items() if f":{k}" in sql
+    }
+    return Query(sql, params)
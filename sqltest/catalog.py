@@ -0,0 +1,146 @@
+from collections import defaultdict
+from dataclasses import dataclass, field
+from textwrap import dedent
+from typing import TYPE_CHECKING
+
+import sqlalchemy as sa
+
+from sqltest.models import Model, ModelColumn, ModelTest
+
+if TYPE_CHECKING:
+    from sqlalchemy.engine import Engine
+
+# enabled, validated primary and unique keys and valid unique indexes on plain
+# columns of a schema's tables; sqlalchemy's reflection doesn't say whether oracle
+# constraints are enforced
+ORACLE_UNIQUE_KEYS = """\
+    select c.table_name, c.constraint_name as key_name, cc.column_name
+    from all_constraints c
+      join all_cons_columns cc on
+        cc.owner = c.owner and
+        cc.constraint_name = c.constraint_name
+    where
+      c.owner = upper(:owner) and
+      c.constraint_type in ('P', 'U') and
+      c.status = 'ENABLED' and
+      c.validated = 'VALIDATED'
+    union all
+    select i.table_name, i.index_name, ic.column_name
+    from all_indexes i
+      join all_ind_columns ic on
+        ic.index_owner = i.owner and
+        ic.index_name = i.index_name
+    where
+      i.table_owner = upper(:owner) and
+      i.uniqueness = 'UNIQUE' and
+      i.index_type not like 'FUNCTION-BASED%' and
+      i.status in ('VALID', 'N/A')"""
+
+
+@dataclass
+class Constraints:
+    """The not null columns and unique keys the database enforces on a set of
+    tables, by lower case schema and table name"""
+
+    not_null: set[tuple[str, str, str]] = field(default_factory=set)
+    unique: dict[tuple[str, str], list[frozenset[str]]] = field(
+        default_factory=lambda: defaultdict(list)
+    )
+
+    def add_unique(self, schema: str, table: str, columns: list[str]):
+        key = frozenset(x.lower() for x in columns)
+        self.unique[(schema.lower(), table.lower())].append(key)
+
+    def is_not_null(self, model: Model, column: str) -> bool:
+        name = (model.schema.lower(), model.name.lower(), column.lower())
+        return name in self.not_null
+
+    def is_unique(self, model: Model, columns: list[str]) -> bool:
+        """Whether no two rows can share values for `columns`.
+
+        Unique keys allow any number of rows with nulls in them, which a uniqueness
+        test would count as duplicates, so only keys on not null columns count.
+        """
+        columns = {x.lower() for x in columns}
+        keys = self.unique.get((model.schema.lower(), model.name.lower()), [])
+        return any(
+            key <= columns and all(self.is_not_null(model, x) for x in key)
+            for key in keys
+        )
+
+    def enforces(self, model: Model, column: ModelColumn | None, test: ModelTest):
+        """Whether the database guarantees that a test passes"""
+        match test.name:
+            case "not_null":
+                return self.is_not_null(model, column.name)
+            case "unique":
+                return self.is_unique(model, [column.name])
+            case "unique_combination_of_columns":
+                return self.is_unique(model, test.kwargs["columns"])
+        return False
+
+
+def is_unique_key(index: dict) -> bool:
+    """Whether a reflected index makes its columns unique across the whole table.
+
+    Partial indexes, e.g. `postgresql_where` or `sqlite_where`, only cover some of
+    the rows, and expression indexes have no column names for their expressions.
+    """
+    if not index["unique"] or None in index["column_names"]:
+        return False
+    options = index.get("dialect_options", {})
+    return not any(k.endswith("_where") and v is not None for k, v in options.items())
+
+
+def load_constraints(engine: "Engine", models: list[Model]) -> Constraints:
+    """Reads the constraints on the models' tables from the database's catalog,
+    with a few bulk queries per schema"""
+    constraints = Constraints()
+    tables = defaultdict(set)
+    for model in models:
+        tables[model.schema].add(model.name.lower())
+
+    inspector = sa.inspect(engine)
+    for schema, names in tables.items():
+        filter_names = sorted(names)
+        columns = inspector.get_multi_columns(
+            schema=schema, filter_names=filter_names, kind=sa.engine.ObjectKind.ANY
+        )
+        for (_, table), table_columns in columns.items():
+            for column in table_columns:
+                if not column["nullable"]:
+                    key = (schema.lower(), table.lower(), column["name"].lower())
+                    constraints.not_null.add(key)
+
+        if engine.dialect.name == "oracle":
+            keys = defaultdict(list)
+            with engine.connect() as db:
+                rows = db.execute(
+                    sa.text(dedent(ORACLE_UNIQUE_KEYS)), {"owner": schema}
+                )
+                for table, key_name, column in rows:
+                    if table.lower() in names:
+                        keys[(table, key_name)].append(column)
+            for (table, _), key_columns in keys.items():
+                constraints.add_unique(schema, table, key_columns)
+            continue
+
+        pks = inspector.get_multi_pk_constraint(
+            schema=schema, filter_names=filter_names
+        )
+        for (_, table), pk in pks.items():
+            if pk["constrained_columns"]:
+                constraints.add_unique(schema, table, pk["constrained_columns"])
+        uniques = inspector.get_multi_unique_constraints(
+            schema=schema, filter_names=filter_names
+        )
+        for (_, table), table_uniques in uniques.items():
+            for unique in table_uniques:
+                constraints.add_unique(schema, table, unique["column_names"])
+        indexes = inspector.get_multi_indexes(schema=schema, filter_names=filter_names)
+        for (_, table), table_indexes in indexes.items():
+            for index in table_indexes:
+                if is_unique_key(index):
+                    constraints.add_unique(schema, table, index["column_names"])
+
+    return constraints
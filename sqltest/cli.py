@@ -1,12 +1,42 @@
 from pathlib import Path
 
-import yaml
-from dotenv import load_dotenv
-from sqltest.models import Config
-from sqltest.runner import TestRunner
 import click
 
-load_dotenv(Path.cwd().absolute() / ".env")
+# heavy dependencies (sqlalchemy, yaml, dotenv) are imported by the commands that
+# use them, so that `--help`, `init` etc. start quickly
+
+
+def load_env():
+    """Loads environment variables from a `.env` file in the working directory"""
+    from dotenv import load_dotenv
+
+    load_dotenv(Path.cwd().absolute() / ".env")
+
+
+def get_config(ctx: click.Context):
+    """Loads the project config the first time a command needs it"""
+    if "CONFIG" not in ctx.obj:
+        from sqltest.models import Config
+
+        config_path = Path(ctx.obj["CONFIG_PATH"])
+        if not config_path.exists():
+            raise click.UsageError(f"Could not find a config file at {config_path}")
+        load_env()
+        ctx.obj["CONFIG"] = Config.from_yaml(config_path)
+    return ctx.obj["CONFIG"]
+
+
+def parse_shard(ctx, param, value: str | None) -> tuple[int, int] | None:
+    """Parses a shard given as `I/N`"""
+    if value is None:
+        return None
+    try:
+        index, count = (int(x) for x in value.split("/"))
+    except ValueError:
+        raise click.BadParameter("expected I/N, e.g. 2/4")
+    if not 1 <= index <= count:
+        raise click.BadParameter("expected 1 <= I <= N")
+    return index, count
 
 
 @click.group()
@@ -14,25 +44,284 @@ load_dotenv(Path.cwd().absolute() / ".env")
 @click.pass_context
 def cli(ctx, config):
     ctx.ensure_object(dict)
-    config_path = Path(config)
-    if config_path.exists():
-        ctx.obj["CONFIG"] = Config.from_yaml(config)
+    ctx.obj["CONFIG_PATH"] = config
 
 
 @cli.command()
 @click.pass_context
 @click.argument("models", nargs=-1)
-def test(ctx, models: str | tuple[str]):
-    runner = TestRunner(ctx.obj["CONFIG"])
-    if models:
-        runner.run(models)
-    else:
-        runner.run()
+@click.option(
+    "-t",
+    "--threads",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Number of tests to run concurrently (defaults to `threads` in the config)",
+)
+@click.option(
+    "--fuse/--no-fuse",
+    default=None,
+    help="Evaluate row-level tests on each model in a single scan",
+)
+@click.option(
+    "--preflight/--no-preflight",
+    default=None,
+    help="Pass tests that database constraints already guarantee without running them",
+)
+@click.option(
+    "--mode",
+    type=click.Choice(["count", "probe"]),
+    default=None,
+    help="Count every failing row, or stop at the first one (defaults to `mode` in the config)",
+)
+@click.option(
+    "--count-failures/--no-count-failures",
+    default=None,
+    help="In probe mode, count the failing rows of tests whose probe failed (defaults to `count_failures` in the config, on by default)",
+)
+@click.option(
+    "--approximate/--exact",
+    default=None,
+    help="Check unique keys with an approximate distinct count before counting duplicates exactly",
+)
+@click.option(
+    "--approximate-margin",
+    type=click.FloatRange(min=0, max=1),
+    default=None,
+    help="Relative error expected of the estimate: the exact check is only skipped when the estimate exceeds the row count by at least this fraction",
+)
+@click.option(
+    "--no-cache",
+    "no_cache",
+    is_flag=True,
+    help="Neither reuse nor store cached test results",
+)
+@click.option(
+    "--refresh",
+    is_flag=True,
+    help="Re-run every test and refresh its cached result",
+)
+@click.option(
+    "--full-refresh",
+    is_flag=True,
+    help="Test every row of incremental models, not only the rows added since the last run",
+)
+@click.option(
+    "--async",
+    "use_async",
+    is_flag=True,
+    help="Run tests on an asyncio event loop using the async driver for the source",
+)
+@click.option(
+    "--concurrency",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Number of queries kept in flight with --async (defaults to `concurrency` in the config)",
+)
+@click.option(
+    "--report-json",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Write each test's result and timings to a json file",
+)
+@click.option(
+    "--junit",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Write each test's result and timings to a junit xml file",
+)
+@click.option(
+    "--slowest",
+    type=click.IntRange(min=0),
+    default=0,
+    help="List the N slowest tests at the end of the run",
+)
+@click.option(
+    "--time-budget",
+    type=click.FloatRange(min=0),
+    default=None,
+    help="Seconds the whole run may take; tests still running or queued after that time out",
+)
+@click.option(
+    "--order",
+    type=click.Choice(["config", "longest"]),
+    default=None,
+    help="Run tests in config order, or longest first based on previous runs",
+)
+@click.option(
+    "--max-per-model",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Maximum number of tests running against any one model at a time",
+)
+@click.option(
+    "--failed-first",
+    is_flag=True,
+    help="Run tests that failed or errored in the previous run first",
+)
+@click.option(
+    "--max-failures",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Stop the run after N tests fail, error or time out",
+)
+@click.option("--fail-fast", is_flag=True, help="Stop the run at the first failure")
+@click.option(
+    "--store-failures",
+    type=click.Path(file_okay=False),
+    default=None,
+    help="Write the rows failing each test to a csv file in this directory",
+)
+@click.option(
+    "--store-failures-limit",
+    type=click.IntRange(min=1),
+    default=1000,
+    show_default=True,
+    help="Maximum number of failing rows to store per test",
+)
+@click.option(
+    "--arraysize",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Number of rows fetched at a time when storing failing rows (defaults to the source's `arraysize`, or 1000)",
+)
+@click.option(
+    "--shard",
+    callback=parse_shard,
+    default=None,
+    metavar="I/N",
+    help="Only run the I-th of N shards of the tests",
+)
+@click.option(
+    "--shard-durations",
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+    help="Split shards by the test durations in this file, written by `merge-results --durations`, rather than by hashing test ids",
+)
+@click.option(
+    "--state",
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+    help="A saved manifest for `state:modified` to compare model files against (defaults to the files as of the last run in which their tests passed)",
+)
+def test(
+    ctx,
+    models: str | tuple[str],
+    threads: int | None,
+    fuse: bool | None,
+    preflight: bool | None,
+    mode: str | None,
+    count_failures: bool | None,
+    approximate: bool | None,
+    approximate_margin: float | None,
+    no_cache: bool,
+    refresh: bool,
+    full_refresh: bool,
+    use_async: bool,
+    concurrency: int | None,
+    report_json: str | None,
+    junit: str | None,
+    slowest: int,
+    time_budget: float | None,
+    order: str | None,
+    max_per_model: int | None,
+    failed_first: bool,
+    max_failures: int | None,
+    fail_fast: bool,
+    store_failures: str | None,
+    store_failures_limit: int,
+    arraysize: int | None,
+    shard: tuple[int, int] | None,
+    shard_durations: str | None,
+    state: str | None,
+):
+    from sqltest.runner import AsyncTestRunner, TestRunner
+
+    kwargs = {}
+    runner_cls = TestRunner
+    if use_async:
+        runner_cls = AsyncTestRunner
+        kwargs["concurrency"] = concurrency
+
+    config = get_config(ctx)
+    try:
+        runner = runner_cls(
+            config,
+            threads=threads,
+            fuse=fuse,
+            preflight=preflight,
+            mode=mode,
+            count_failures=count_failures,
+            approximate=approximate,
+            approximate_margin=approximate_margin,
+            cache=False if no_cache else None,
+            refresh=refresh,
+            full_refresh=full_refresh,
+            report_json=report_json,
+            junit=junit,
+            slowest=slowest,
+            time_budget=time_budget,
+            order=order,
+            max_per_model=max_per_model,
+            failed_first=failed_first,
+            max_failures=1 if fail_fast else max_failures,
+            store_failures=store_failures,
+            store_failures_limit=store_failures_limit,
+            arraysize=arraysize,
+            shard=shard,
+            shard_durations=shard_durations,
+            state=state,
+            **kwargs,
+        )
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    result = runner.run(models) if models else runner.run()
+    if not result.success:
+        ctx.exit(1)
+
+
+@cli.command("merge-results")
+@click.argument("reports", nargs=-1, required=True, type=click.Path(dir_okay=False))
+@click.option(
+    "-o",
+    "--output",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Write the merged json report to this file",
+)
+@click.option(
+    "--durations",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Write the tests' durations to this file, for `test --shard-durations`",
+)
+@click.pass_context
+def merge_results(ctx, reports: tuple[str], output: str | None, durations: str | None):
+    """Combine json reports, e.g. from shards of a suite, into one result"""
+    import json
+
+    from sqltest import reports as sqltest_reports
+
+    try:
+        report = sqltest_reports.merge_json(reports)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    if output:
+        Path(output).write_text(json.dumps(report, indent=2))
+    if durations:
+        test_durations = sqltest_reports.durations(report)
+        Path(durations).write_text(json.dumps(test_durations, indent=2))
+
+    summary = report["summary"]
+    print(" - ".join(f"{k.capitalize()}: {v:,}" for k, v in summary.items()))
+    if summary["tested"] - summary["passed"]:
+        ctx.exit(1)
 
 
 @cli.command()
 def init():
     """Initialize a sql test project configuration file"""
+    import yaml
+
     config_file = Path("sqltest.yml")
     if config_file.exists():
         print(f"A {config_file.name} config file already exists for this project")
@@ -60,10 +349,30 @@ def init():
     print("Happy testing!")
 
 
+@cli.command()
+@click.pass_context
+@click.option("--full", is_flag=True, help="Re-parse every model file")
+def parse(ctx, full: bool):
+    """Parse the model files and save the compiled manifest"""
+    from sqltest.models import Config, Manifest, load_yaml
+
+    config_path = Path(ctx.obj["CONFIG_PATH"])
+    with config_path.open("rb") as f:
+        obj = load_yaml(f)
+
+    manifest_path = Path(obj.get("target_dir", ".sqltest")) / "manifest.pickle"
+    manifest = Manifest(manifest_path) if full else Manifest.load(manifest_path)
+    config = Config.from_obj(obj, manifest)
+
+    print(f"Parsed {len(config.models):,} models into {manifest_path}")
+
+
 @cli.command()
 @click.pass_context
 def debug(ctx):
-    config = ctx.obj["CONFIG"]
+    from sqltest.runner import TestRunner
+
+    config = get_config(ctx)
     runner = TestRunner(config)
 
     print(f"Testing connection to {config.source.name} ({runner.engine.url})")
@@ -1,17 +1,60 @@
+from dataclasses import dataclass, field, replace
 from functools import wraps
+import re
 from textwrap import dedent, indent
 from typing import Any, Callable
 
-from sqltest.models import Model, ModelColumn
+from sqltest.models import Model, ModelColumn, ModelTest
 
-type SqlTestFunc = Callable[[Model, ModelColumn, ...], str]
+
+@dataclass
+class Query:
+    """The sql for a test along with the values bound to its parameters"""
+
+    sql: str
+    params: dict[str, Any] = field(default_factory=dict)
+    inner: str | None = None
+
+
+class Params(dict):
+    """Collects the values bound to a query, giving each a unique parameter name"""
+
+    def bind(self, value: Any) -> str:
+        """Registers a value and returns the placeholder to use in its place"""
+        name = f"p{len(self)}"
+        self[name] = value
+        return f":{name}"
+
+
+# string literals and quoted identifiers, whose whitespace is significant
+QUOTED = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")""")
+
+
+def normalize_sql(sql: str) -> str:
+    """Collapses runs of whitespace outside of quotes, so that queries differing
+    only in their formatting compare equal"""
+    parts = QUOTED.split(sql)
+    for i in range(0, len(parts), 2):
+        parts[i] = re.sub(r"\s+", " ", parts[i])
+    return "".join(parts).strip()
+
+
+def hinted(query: Query, hint: str) -> Query:
+    """Adds an optimizer hint, e.g. `parallel(8)`, to a query's outermost select"""
+    sql = re.sub(r"^(\s*select)\b", rf"\1 /*+ {hint} */", query.sql, count=1)
+    return replace(query, sql=sql)
+
+
+type SqlTestFunc = Callable[[Model, ModelColumn, ...], Query]
 
 
 def wrap_test_sql(fn):
     @wraps(fn)
     def wrapper(*args, **kwargs):
-        raw_sql = fn(*args, **kwargs)
-        formatted_test_sql = indent(dedent(raw_sql).strip(), " " * 2)
+        raw = fn(*args, **kwargs)
+        if not isinstance(raw, Query):
+            raw = Query(raw)
+        formatted_test_sql = indent(dedent(raw.sql).strip(), " " * 2)
         sql = """\
             select
               count(*) as failures
@@ -21,11 +64,107 @@ def wrap_test_sql(fn):
             
             )"""
         final_sql = dedent(sql).format(test_sql=formatted_test_sql)
-        return final_sql
+        return Query(final_sql, raw.params, inner=formatted_test_sql)
+
+    return wrapper
+
+
+# dialects supporting `fetch first n rows only`
+FETCH_FIRST_DIALECTS = {"oracle", "postgresql", "db2"}
+
+
+def probe(query: Query, dialect: str) -> Query:
+    """Rewrites a test to stop at the first failing row.
+
+    Rather than counting every failing row, the query returns 1 if any row fails and
+    0 otherwise, using `fetch first` where the dialect supports it and `exists`
+    elsewhere. Queries that don't wrap a row-returning test are returned unchanged.
+    """
+    if query.inner is None:
+        return query
+
+    if dialect in FETCH_FIRST_DIALECTS:
+        sql = """\
+            select
+              count(*) as failures
+            from (
+            
+            {test_sql}
+              fetch first 1 rows only
+            
+            )"""
+    else:
+        sql = """\
+            select
+              case when exists (
+            
+            {test_sql}
+            
+              ) then 1 else 0 end as failures"""
+
+    final_sql = dedent(sql).format(test_sql=query.inner)
+    return Query(final_sql, query.params, inner=query.inner)
+
+
+def predicate_test(fn):
+    """Builds a row-level test from a function returning the predicate that a
+    failing row matches.
 
+    Values the predicate compares against are bound through `params` rather than
+    formatted into the sql. The predicate function is kept on the test as
+    `predicate`, which lets `fused` evaluate several tests on the same model in a
+    single scan.
+    """
+
+    @wrap_test_sql
+    @wraps(fn)
+    def wrapper(model: Model, column: ModelColumn | None = None, **kwargs) -> Query:
+        params = Params()
+        predicate = fn(model, column, params=params, **kwargs)
+        selected = column.name if column else "*"
+        sql = (
+            f"select {selected}\n"
+            f"from {model.relation}\n"
+            f"where\n"
+            f"{indent(predicate, ' ' * 2)}"
+        )
+        return Query(sql, params)
+
+    wrapper.predicate = fn
     return wrapper
 
 
+def is_fusable(test_name: str) -> bool:
+    """Whether a test can be evaluated in a fused single-scan query"""
+    return hasattr(globals().get(test_name), "predicate")
+
+
+def is_row_level(test_name: str) -> bool:
+    """Whether a test checks each row on its own, so that it can be run against a
+    subset of a model's rows"""
+    return is_fusable(test_name) or test_name == "relationships"
+
+
+def fused(model: Model, tests: list[tuple[ModelColumn | None, ModelTest]]) -> Query:
+    """Evaluates several row-level tests on a model in a single scan.
+
+    The query returns one row with a failure count per test, in the order the tests
+    were passed.
+    """
+    params = Params()
+    counts = []
+    for i, (column, test) in enumerate(tests):
+        fn = globals()[test.name].predicate
+        predicate = fn(model, column, params=params, **test.kwargs)
+        predicate = indent(predicate, " " * 6).strip()
+        counts.append(f"sum(case when ({predicate}) then 1 else 0 end) as failures_{i}")
+
+    sql = "select\n{counts}\nfrom {model.relation}".format(
+        counts=indent(",\n".join(counts), " " * 2), model=model
+    )
+    return Query(sql, params)
+
+
 @wrap_test_sql
 def unique(model: Model, column: ModelColumn, **kwargs) -> str:
     """Evaluates whether all values in a column are unique"""
@@ -33,66 +172,46 @@ def unique(model: Model, column: ModelColumn, **kwargs) -> str:
         select
           {column.name},
           count(*) as records
-        from {model.schema}.{model.name}
+        from {model.relation}
         group by {column.name}
           having count(*) > 1"""
     return sql
 
 
-@wrap_test_sql
-def not_null(model: Model, column: ModelColumn, **kwargs) -> str:
+@predicate_test
+def not_null(model: Model, column: ModelColumn, params: Params, **kwargs) -> str:
     """Evaluates whether all values in a column are not null"""
-    sql = f"""\
-        select {column.name}
-        from {model.schema}.{model.name}
-        where
-          {column.name} is null"""
-    return sql
+    return f"{column.name} is null"
 
 
-@wrap_test_sql
+@predicate_test
 def accepted_values(
-    model: Model, column: ModelColumn, values: list[Any], **kwargs
+    model: Model, column: ModelColumn, params: Params, values: list[Any], **kwargs
 ) -> str:
     """Evaluates whether the column contains any other than those passed in `values`"""
+    values_clause = ", ".join(params.bind(v) for v in values)
 
-    # quote strings if `values` is a list of strings
-    first_value = values[0]
-    if isinstance(first_value, str):
-        values_clause = ", ".join(f"'{v}'" for v in values)
-    else:
-        values_clause = ", ".join(values)
+    predicate = f"{column.name} is not null and\n{column.name} not in ({values_clause})"
+    return predicate
 
-    sql = f"""\
-        select {column.name}
-        from {model.schema}.{model.name}
-        where
-          {column.name} is not null and
-          {column.name} not in ({values_clause})"""
 
-    return sql
-
-
-@wrap_test_sql
+@predicate_test
 def expression_is_true(
     model: Model,
     column: ModelColumn,
+    params: Params,
     expression: str,
     where: str | None = None,
     **kwargs,
 ) -> str:
     """Evaluates whether the passed sql expression is true"""
-    sql = f"""\
-        select *
-        from {model.schema}.{model.name}
-        where
-          not({expression})"""
+    predicate = f"not({expression})"
 
     # add the where clause, if provided
     if where:
-        sql = f"""{dedent(sql)} and\n  {where}"""
+        predicate += f" and\n{where}"
 
-    return sql
+    return predicate
 
 
 @wrap_test_sql
@@ -107,7 +226,7 @@ def relationships(
     """Checks referential integrity between the source column and a foreign key in another table."""
     sql = f"""\
         select a.{column.name}
-        from {model.schema}.{model.name} a
+        from {model.relation} a
           left join {to} b on a.{column.name} = b.{field}
         where
           a.{column.name} is not null and
@@ -119,6 +238,67 @@ def relationships(
     return sql
 
 
+def related(tests: list[tuple[Model, ModelColumn]], to: str, field: str) -> Query:
+    """Evaluates several `relationships` tests that point at the same field of a
+    parent table in one query, which reads the parent table once.
+
+    The distinct keys of each child model's column are counted and anti-joined to
+    the parent together. The query returns a row for each test with failures: the
+    test's position in `tests` and its number of failing rows.
+    """
+    branches = []
+    for i, (model, column) in enumerate(tests):
+        branch = f"""\
+            select
+              {i} as test_id,
+              a.{column.name} as child_key,
+              count(*) as records
+            from {model.relation} a
+            where a.{column.name} is not null
+            group by a.{column.name}"""
+        branches.append(dedent(branch))
+
+    sql = """\
+        select
+          k.test_id,
+          sum(k.records) as failures
+        from (
+        {keys}
+        ) k
+          left join {to} b on k.child_key = b.{field}
+        where b.{field} is null
+        group by k.test_id"""
+    keys = indent("\nunion all\n".join(branches), " " * 2)
+    return Query(dedent(sql).format(keys=keys, to=to, field=field))
+
+
+# approximate distinct count aggregates, by dialect
+APPROX_COUNT_DISTINCT = {
+    "oracle": "approx_count_distinct",
+    "mssql": "approx_count_distinct",
+    "snowflake": "approx_count_distinct",
+    "bigquery": "approx_count_distinct",
+    "databricks": "approx_count_distinct",
+}
+
+
+def approx_unique(model: Model, columns: list[str], function: str) -> Query:
+    """Counts a model's rows, the rows where its key is not null and an estimate of
+    the key's distinct values, for a cheap check of whether the key is unique.
+
+    A key of several columns is estimated from its values joined with a separator,
+    which can only make different keys look alike, never the reverse.
+    """
+    key = " || '|' || ".join(columns)
+    sql = f"""\
+        select
+          count(*) as records,
+          count({columns[0]}) as non_null,
+          {function}({key}) as estimate
+        from {model.relation}"""
+    return Query(dedent(sql))
+
+
 @wrap_test_sql
 def unique_combination_of_columns(model: Model, columns: list[str], **kwargs) -> str:
     """Checks for uniqueness across one or more columns.
@@ -131,7 +311,7 @@ def unique_combination_of_columns(model: Model, columns: list[str], **kwargs) ->
         select
           {column_list},
           count(*) as records
-        from {model.schema}.{model.name}
+        from {model.relation}
         group by {column_list}
         having count(*) > 1
     """
@@ -139,7 +319,7 @@ def unique_combination_of_columns(model: Model, columns: list[str], **kwargs) ->
     return sql
 
 
-def at_least_one(model: Model, column: ModelColumn, **kwargs) -> str:
+def at_least_one(model: Model, column: ModelColumn, **kwargs) -> Query:
     sql = f"""\
         select
           case when records = 0 then 1 else 0 end as failures
@@ -147,62 +327,68 @@ def at_least_one(model: Model, column: ModelColumn, **kwargs) -> str:
         
           select
             count(*) as records
-          from {model.schema}.{model.name}
+          from {model.relation}
           where
             {column.name} is not null
         
         )"""
 
-    return dedent(sql)
+    return Query(dedent(sql))
 
 
-@wrap_test_sql
+@predicate_test
 def regexp_like(
     model: Model,
     column: ModelColumn,
+    params: Params,
     expression: str,
     flags: str | None = None,
     **kwargs,
 ) -> str:
     """Check whether a column matches a regex pattern"""
-    sql = f"""
-        select {column.name}
-        from {model.schema}.{model.name}
-        where
-          {column.name} is not null and
-          not(regexp_like({column.name}, '{expression}', '{flags or ''}'))
-    """
+    args = [column.name, params.bind(expression)]
+    if flags:
+        args.append(params.bind(flags))
 
-    return sql
+    predicate = f"{column.name} is not null and\nnot(regexp_like({', '.join(args)}))"
+    return predicate
 
 
-@wrap_test_sql
-def uuid(model: Model, column: ModelColumn, **kwargs) -> str:
+@predicate_test
+def uuid(model: Model, column: ModelColumn, params: Params, **kwargs) -> str:
     """Checks whether column values match a uuid regex"""
     pattern = r"^[a-f0-9]{8}-([a-f0-9]{4}-){3}[a-f0-9]{12}$"
-    sql = f"""
-        select {column.name}
-        from {model.schema}.{model.name}
-        where
-          {column.name} is not null and
-          not(regexp_like({column.name}, '{pattern}', 'i'))
-    """
-    return sql
+    predicate = (
+        f"{column.name} is not null and\n"
+        f"not(regexp_like({column.name}, {params.bind(pattern)}, {params.bind('i')}))"
+    )
+    return predicate
 
 
-@wrap_test_sql
+@predicate_test
 def accepted_range(
     model: Model,
     column: ModelColumn,
+    params: Params,
     min_value: any = None,
     max_value: any = None,
     inclusive: bool = True,
     where: str | None = None,
+    **kwargs,
 ) -> str:
-    """Checks whether a column falls within an accepted range"""
+    """Checks whether a column falls within an accepted range
+
+    Strings are treated as sql expressions (e.g. `sysdate`) and included as-is, any
+    other value is bound as a parameter.
+    """
     if min_value is None and max_value is None:
         raise ValueError("Specify at least a `min_value` or `max_value`")
 
+    if min_value is not None and not isinstance(min_value, str):
+        min_value = params.bind(min_value)
+    if max_value is not None and not isinstance(max_value, str):
+        max_value = params.bind(max_value)
+
     min_op = "<="
     max_op = ">="
     if inclusive:
@@ -220,51 +406,33 @@ def accepted_range(
     if max_value is not None:
         clauses.append(f"{column.name} {max_op} {max_value}")
 
-    sql = f"""
-        select {column.name}
-        from {model.schema}.{model.name}
-        where
-          {column.name} is not null and
-          {' or '.join(clauses)}
-    """
+    predicate = f"{column.name} is not null and\n{' or '.join(clauses)}"
+    return predicate
 
-    return sql
 
-
-@wrap_test_sql
+@predicate_test
 def bit(
-    model: Model, column: ModelColumn, yes: str = "Y", no: str = "N", **kwargs
+    model: Model,
+    column: ModelColumn,
+    params: Params,
+    yes: str = "Y",
+    no: str = "N",
+    **kwargs,
 ) -> str:
     """Checks whether a column has exclusively yes/no values."""
-    if isinstance(yes, str):
-        yes = f"'{yes}'"
-    if isinstance(no, str):
-        no = f"'{no}'"
-
-    sql = f"""
-        select {column.name}
-        from {model.schema}.{model.name}
-        where
-          {column.name} is not null and
-          {column.name} not in ({yes}, {no})
-    """
-    return sql
+    yes = params.bind(yes)
+    no = params.bind(no)
 
+    predicate = f"{column.name} is not null and\n{column.name} not in ({yes}, {no})"
+    return predicate
 
-@wrap_test_sql
-def value_equals(model: Model, column: ModelColumn, value: any, where: str) -> str:
-    if isinstance(value, str):
-        value = f"'{value}'"
 
-    sql = f"""
-        select {column.name}
-        from {model.schema}.{model.name}
-        where
-          {where} and
-          not({column.name} = {value})
-    """
-
-    return sql
+@predicate_test
+def value_equals(
+    model: Model, column: ModelColumn, params: Params, value: any, where: str, **kwargs
+) -> str:
+    predicate = f"{where} and\nnot({column.name} = {params.bind(value)})"
+    return predicate
 
 
 @wrap_test_sql
@@ -290,7 +458,7 @@ def agg_value(
       select
         {',\n  '.join(group_by)},
         {agg_expression} as agg_value
-      from {model.schema}.{model.name}
+      from {model.relation}
       {{where}}
       group by 
         {', '.join(group_by)}
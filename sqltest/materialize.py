@@ -0,0 +1,59 @@
+from dataclasses import dataclass
+import itertools
+
+# how each dialect names, creates and drops a temporary table visible only to the
+# session that created it; oracle's private temporary tables need 18c or later
+TEMP_TABLES = {
+    "oracle": (
+        "ora$ptt_{name}",
+        "create private temporary table {table} on commit preserve definition as "
+        "select * from {relation}",
+        "drop table {table}",
+    ),
+    "postgresql": (
+        "{name}",
+        "create temporary table {table} as select * from {relation}",
+        "drop table if exists {table}",
+    ),
+    "mysql": (
+        "{name}",
+        "create temporary table {table} as select * from {relation}",
+        "drop temporary table if exists {table}",
+    ),
+    "sqlite": (
+        "{name}",
+        "create temporary table {table} as select * from {relation}",
+        "drop table if exists temp.{table}",
+    ),
+    "mssql": (
+        "#{name}",
+        "select * into {table} from {relation}",
+        "drop table if exists {table}",
+    ),
+}
+
+_counter = itertools.count()
+
+
+@dataclass
+class Snapshot:
+    """A temporary table holding a copy of a model's rows for the length of a
+    session"""
+
+    table: str
+    create: str
+    drop: str
+
+
+def snapshot(dialect: str, relation: str) -> Snapshot | None:
+    """The statements snapshotting `relation` into a new temporary table, if the
+    dialect supports it"""
+    if dialect not in TEMP_TABLES:
+        return None
+    name, create, drop = TEMP_TABLES[dialect]
+    table = name.format(name=f"sqltest_snapshot_{next(_counter)}")
+    return Snapshot(
+        table=table,
+        create=create.format(table=table, relation=relation),
+        drop=drop.format(table=table),
+    )
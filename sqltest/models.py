@@ -1,8 +1,22 @@
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, replace
+from functools import cached_property
+import hashlib
 from pathlib import Path
+import pickle
 from typing import Self, Any
 import yaml
 
+from sqltest.selection import Registry
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:  # pyyaml built without libyaml
+    from yaml import SafeLoader
+
+
+# test config keys that control how the runner executes a test
+TEST_SETTINGS = ("mode", "timeout", "approximate")
+
 
 @dataclass
 class ModelTest:
@@ -10,6 +24,9 @@ class ModelTest:
 
     name: str
     kwargs: dict[str, Any] = field(default_factory=dict)
+    mode: str | None = None
+    timeout: float | None = None
+    approximate: bool | None = None
 
     @classmethod
     def from_obj(cls, obj: dict | str) -> Self:
@@ -20,7 +37,13 @@ class ModelTest:
             name = obj
             kwargs = {}
 
-        return cls(name, kwargs)
+        # runner settings aren't passed on to the test function
+        settings = {}
+        if isinstance(kwargs, dict):
+            settings = {k: v for k, v in kwargs.items() if k in TEST_SETTINGS}
+            kwargs = {k: v for k, v in kwargs.items() if k not in TEST_SETTINGS}
+
+        return cls(name, kwargs, **settings)
 
 
 @dataclass
@@ -44,12 +67,55 @@ class ModelColumn:
         return cls(name, tests)
 
 
+@dataclass
+class Incremental:
+    """Settings for testing only the rows added to a model since the last run"""
+
+    column: str
+
+
+@dataclass
+class PartitionBy:
+    """How to split row-level tests on a large model into slices run side by side:
+    by ranges of `column` between `bounds`, or by the table's own partitions when
+    `discover` is set"""
+
+    column: str | None = None
+    bounds: list[Any] = field(default_factory=list)
+    discover: bool = False
+
+    @classmethod
+    def from_obj(cls, obj: dict | str) -> Self:
+        if obj == "discover":
+            return cls(discover=True)
+        return cls(**obj)
+
+
 @dataclass
 class Model:
     name: str
     schema: str
     tests: list[ModelTest] = field(default_factory=list)
     columns: list[ModelColumn] = field(default_factory=list)
+    fingerprint: str | None = None
+    incremental: Incremental | None = None
+    timeout: float | None = None
+    partition_by: PartitionBy | None = None
+    parallel: int | None = None
+    materialize: str | None = None
+    tags: list[str] = field(default_factory=list)
+    relation_sql: str | None = field(default=None, repr=False, compare=False)
+
+    @property
+    def relation(self) -> str:
+        """The relation tests select from: the model's table, unless it has been
+        scoped to a subquery"""
+        return self.relation_sql or f"{self.schema}.{self.name}"
+
+    def scoped(self, relation_sql: str) -> Self:
+        """A copy of the model whose tests select from `relation_sql` instead of
+        the model's table"""
+        return replace(self, relation_sql=relation_sql)
 
     @classmethod
     def from_obj(cls, obj: dict) -> Self:
@@ -57,7 +123,34 @@ class Model:
         schema = obj["schema"]
         tests = [ModelTest.from_obj(test) for test in obj.get("tests", [])]
         columns = [ModelColumn.from_obj(col) for col in obj.get("columns", [])]
-        return cls(name=name, schema=schema, tests=tests, columns=columns)
+        fingerprint = obj.get("fingerprint")
+        incremental = None
+        if "incremental" in obj:
+            incremental = Incremental(**obj["incremental"])
+        timeout = obj.get("timeout")
+        partition_by = None
+        if "partition_by" in obj:
+            partition_by = PartitionBy.from_obj(obj["partition_by"])
+        parallel = obj.get("parallel")
+        materialize = obj.get("materialize")
+        if materialize not in (None, "temp"):
+            raise ValueError(f"Unknown materialize setting: {materialize}")
+        tags = obj.get("tags", [])
+        if isinstance(tags, str):
+            tags = [tags]
+        return cls(
+            name=name,
+            schema=schema,
+            tests=tests,
+            columns=columns,
+            fingerprint=fingerprint,
+            incremental=incremental,
+            timeout=timeout,
+            partition_by=partition_by,
+            parallel=parallel,
+            materialize=materialize,
+            tags=tags,
+        )
 
 
 @dataclass
@@ -73,51 +166,244 @@ class TestCase:
 
 @dataclass
 class Source:
+    """A data source and the settings for its connection pool.
+
+    `kwargs` are passed on to `sqlalchemy.create_engine`, and each statement in
+    `session_init` is run on every new connection, e.g. to set NLS parameters.
+    `arraysize` and `prefetchrows` tune how many rows drivers fetch per round trip.
+    """
+
     name: str
     url: str
     kwargs: dict = field(default_factory=dict)
+    pool_size: int | None = None
+    max_overflow: int | None = None
+    pool_pre_ping: bool = False
+    pool_recycle: int | None = None
+    arraysize: int | None = None
+    prefetchrows: int | None = None
+    session_init: list[str] = field(default_factory=list)
+
+    @classmethod
+    def from_obj(cls, obj: dict) -> Self:
+        obj = dict(obj)
+        session_init = obj.pop("session_init", [])
+        if isinstance(session_init, str):
+            session_init = [session_init]
+        return cls(session_init=session_init, **obj)
+
+
+@dataclass
+class CacheSettings:
+    """Settings for the local cache of test results"""
+
+    enabled: bool = True
+    fingerprint: str | None = None
+    max_age: int = 7 * 24 * 60 * 60
+    max_entries: int = 100_000
 
 
 @dataclass
 class Config:
     source: Source
     models: list[Model] = field(default_factory=list)
+    threads: int = 1
+    concurrency: int = 100
+    fuse: bool = False
+    preflight: bool = False
+    mode: str = "count"
+    count_failures: bool = True
+    approximate: bool = False
+    approximate_margin: float = 0.0
+    order: str = "config"
+    max_per_model: int | None = None
+    target_dir: str = ".sqltest"
+    cache: CacheSettings = field(default_factory=CacheSettings)
+    manifest: "Manifest | None" = field(default=None, repr=False, compare=False)
 
     @classmethod
-    def from_obj(cls, obj: dict) -> Self:
-        source = Source(**obj["source"])
+    def from_obj(cls, obj: dict, manifest: "Manifest | None" = None) -> Self:
+        source = Source.from_obj(obj["source"])
         models = []
 
         models_dir = obj.get("models_dir", [])
         if isinstance(models_dir, str):
             models_dir = [models_dir]
+        if models_dir and manifest is None:
+            target_dir = obj.get("target_dir", ".sqltest")
+            manifest = Manifest.load(Path(target_dir) / "manifest.pickle")
         for path in models_dir:
-            models += gather_models(path)
+            models += gather_models(path, manifest)
+        if manifest is not None:
+            manifest.save()
         if "models" in obj:
             models += [Model.from_obj(model) for model in obj.get("models", [])]
-        return cls(source, models)
+        threads = int(obj.get("threads", 1))
+        concurrency = int(obj.get("concurrency", 100))
+        fuse = bool(obj.get("fuse", False))
+        preflight = bool(obj.get("preflight", False))
+        mode = obj.get("mode", "count")
+        count_failures = bool(obj.get("count_failures", True))
+        approximate = bool(obj.get("approximate", False))
+        approximate_margin = float(obj.get("approximate_margin", 0.0))
+        order = obj.get("order", "config")
+        max_per_model = obj.get("max_per_model")
+        target_dir = obj.get("target_dir", ".sqltest")
+        cache = CacheSettings(**obj.get("cache", {}))
+        return cls(
+            source,
+            models,
+            threads=threads,
+            concurrency=concurrency,
+            fuse=fuse,
+            preflight=preflight,
+            mode=mode,
+            count_failures=count_failures,
+            approximate=approximate,
+            approximate_margin=approximate_margin,
+            order=order,
+            max_per_model=max_per_model,
+            target_dir=target_dir,
+            cache=cache,
+            manifest=manifest,
+        )
 
     @classmethod
     def from_yaml(cls, file_path: str | Path):
-        with Path(file_path).open() as file:
-            obj = yaml.safe_load(file)
+        with Path(file_path).open("rb") as file:
+            obj = load_yaml(file)
             return cls.from_obj(obj)
 
+    @cached_property
+    def registry(self) -> Registry:
+        """The models, indexed for selection. Built on first use, so changes made to
+        the models after that aren't reflected."""
+        return Registry(self.models, self.manifest)
+
     def select_model(self, name: str) -> Model:
         """Selects a model by name"""
-        for model in self.models:
-            if model.name.lower() == name.lower():
-                return model
-        raise ValueError(f'Could not find a model matching "{name}"')
+        return self.registry.get(name)
+
+
+def load_yaml(stream) -> Any:
+    """Parses yaml, using libyaml's loader when it is available"""
+    return yaml.load(stream, Loader=SafeLoader)
+
+
+@dataclass
+class ManifestEntry:
+    mtime_ns: int
+    size: int
+    digest: str
+    model: Model
+
+
+class Manifest:
+    """The models parsed from each model file, reused until the file changes.
+
+    The manifest is pickled to the target directory between runs, so only files whose
+    modification time and contents have changed are parsed again.
+    """
+
+    version = 3
+
+    def __init__(self, path: str | Path | None = None):
+        self.path = Path(path) if path else None
+        self.entries: dict[str, ManifestEntry] = {}
+        self._seen = set()
+        self._changed = False
+
+    @classmethod
+    def load(cls, path: str | Path, strict: bool = False) -> Self:
+        """The manifest saved at `path`, or an empty one if it's missing or unreadable,
+        unless `strict` is set, for a manifest that must exist"""
+        manifest = cls(path)
+        try:
+            with manifest.path.open("rb") as f:
+                version, entries = pickle.load(f)
+        except FileNotFoundError:
+            if strict:
+                raise ValueError(f"No saved manifest at {path}")
+            return manifest
+        except Exception as e:
+            if strict:
+                raise ValueError(f"Could not read the manifest at {path}: {e}")
+            # an unreadable manifest is rebuilt from the model files
+            manifest._changed = True
+            return manifest
+
+        if version == cls.version:
+            manifest.entries = entries
+        elif strict:
+            raise ValueError(f"The manifest at {path} is from another version")
+        else:
+            manifest._changed = True
+        return manifest
+
+    def model(self, yml_file: Path) -> Model:
+        """The model defined in a file, parsing the file only if it has changed"""
+        key = str(yml_file)
+        self._seen.add(key)
+        stat = yml_file.stat()
+
+        entry = self.entries.get(key)
+        if entry and (entry.mtime_ns, entry.size) == (stat.st_mtime_ns, stat.st_size):
+            return entry.model
+
+        content = yml_file.read_bytes()
+        digest = hashlib.sha1(content).hexdigest()
+        if entry is None or entry.digest != digest:
+            model = Model.from_obj(load_yaml(content))
+        else:
+            model = entry.model
+
+        self.entries[key] = ManifestEntry(stat.st_mtime_ns, stat.st_size, digest, model)
+        self._changed = True
+        return model
+
+    def modified(self, state: "Manifest") -> list[Model]:
+        """The models in files that are new or have changed since `state` was
+        saved"""
+        return [
+            entry.model
+            for key, entry in self.entries.items()
+            if key in self._seen
+            and (key not in state.entries or state.entries[key].digest != entry.digest)
+        ]
+
+    def update(self, entries: dict[str, ManifestEntry]):
+        """Records the given files' entries, e.g. those of another manifest"""
+        self.entries.update(entries)
+        self._seen.update(self.entries)
+        self._changed = bool(entries) or self._changed
 
+    def save(self):
+        """Writes the manifest, dropping files that weren't seen since it was loaded"""
+        removed = self.entries.keys() - self._seen
+        if self.path is None or not (self._changed or removed):
+            return
 
-def gather_models(models_dir: str | Path) -> list[Model]:
+        for key in removed:
+            del self.entries[key]
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open("wb") as f:
+            pickle.dump((self.version, self.entries), f, pickle.HIGHEST_PROTOCOL)
+        self._changed = False
+
+
+def gather_models(
+    models_dir: str | Path, manifest: Manifest | None = None
+) -> list[Model]:
     """Gather models from models_dir"""
     models = []
 
     for yml_file in Path(models_dir).rglob("*.yml"):
-        with yml_file.open("r") as f:
-            model_data = yaml.safe_load(f)
+        if manifest is not None:
+            models.append(manifest.model(yml_file))
+            continue
+
+        with yml_file.open("rb") as f:
+            model_data = load_yaml(f)
             model = Model.from_obj(model_data)
             models.append(model)
 
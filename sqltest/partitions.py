@@ -0,0 +1,77 @@
+from dataclasses import dataclass, field
+from textwrap import dedent
+from typing import TYPE_CHECKING, Any
+
+import sqlalchemy as sa
+
+from sqltest.models import Model, PartitionBy
+
+if TYPE_CHECKING:
+    from sqlalchemy.engine import Engine
+
+ORACLE_PARTITIONS = """\
+    select partition_name
+    from all_tab_partitions
+    where
+      table_owner = upper(:owner) and
+      table_name = upper(:name)
+    order by partition_position"""
+
+
+@dataclass
+class Slice:
+    """A part of a model's rows that a row-level test can be run against on its own.
+
+    A slice names a partition of the table with `clause`, e.g. `partition (p2024)`,
+    and/or restricts its rows with `condition`. Together, a model's slices cover
+    each of its rows exactly once.
+    """
+
+    name: str
+    clause: str = ""
+    condition: str | None = None
+    params: dict[str, Any] = field(default_factory=dict)
+
+
+def bound(value: Any, name: str, params: dict[str, Any]) -> str:
+    """A range bound in sql: strings are sql expressions, e.g. `date'2024-01-01'`,
+    and other values are bound as parameters"""
+    if isinstance(value, str):
+        return value
+    params[name] = value
+    return f":{name}"
+
+
+def range_slices(column: str, bounds: list[Any]) -> list[Slice]:
+    """Slices covering the ranges of `column` below, between and above `bounds`,
+    plus the rows where it is null"""
+    slices = []
+    edges = [None, *bounds, None]
+    for i, (low, high) in enumerate(zip(edges, edges[1:])):
+        params = {}
+        conditions = []
+        if low is not None:
+            conditions.append(f"{column} >= {bound(low, 'slice_low', params)}")
+        if high is not None:
+            conditions.append(f"{column} < {bound(high, 'slice_high', params)}")
+        condition = " and ".join(conditions) or f"{column} is not null"
+        slices.append(Slice(f"range {i}", condition=condition, params=params))
+    slices.append(Slice("null", condition=f"{column} is null"))
+    return slices
+
+
+def discover_slices(engine: "Engine", model: Model) -> list[Slice]:
+    """Slices for each of a table's partitions, read from the catalog"""
+    if engine.dialect.name != "oracle":
+        raise ValueError("partition discovery is only supported on oracle")
+    with engine.connect() as db:
+        params = {"owner": model.schema, "name": model.name}
+        rows = db.execute(sa.text(dedent(ORACLE_PARTITIONS)), params)
+        names = [x for x, in rows]
+    return [Slice(x.lower(), clause=f"partition ({x})") for x in names]
+
+
+def slices(engine: "Engine", model: Model, partition_by: PartitionBy) -> list[Slice]:
+    if partition_by.discover:
+        return discover_slices(engine, model)
+    return range_slices(partition_by.column, partition_by.bounds)
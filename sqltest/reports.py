@@ -0,0 +1,176 @@
+import csv
+from datetime import datetime, timezone
+import json
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, Sequence
+import xml.etree.ElementTree as ET
+
+if TYPE_CHECKING:
+    from sqltest.runner import RunResult, TestCase
+
+
+def test_case_record(test_case: "TestCase") -> dict:
+    """A json-serializable summary of a test case's result and timings"""
+    timings = test_case.timings
+    return {
+        "id": test_case.id,
+        "name": test_case.name,
+        "model": f"{test_case.model.schema}.{test_case.model.name}",
+        "column": test_case.column.name if test_case.column else None,
+        "test": test_case.test.name,
+        "kwargs": test_case.test.kwargs,
+        "status": test_case.status,
+        "failures": test_case.failures,
+        "cached": test_case.cached,
+        "approximate": test_case.approximate,
+        "error": str(test_case.error) if test_case.error is not None else None,
+        "queued_at": timings.queued_at,
+        "started_at": timings.started_at,
+        "wait_time": timings.wait_time,
+        "connect_time": timings.connect_time,
+        "execute_time": timings.execute_time,
+        "fetch_time": timings.fetch_time,
+        "duration": timings.duration,
+        "failing_rows": (
+            str(test_case.failing_rows) if test_case.failing_rows else None
+        ),
+    }
+
+
+def write_json(
+    path: str | Path,
+    test_cases: list["TestCase"],
+    result: "RunResult",
+    shard: dict | None = None,
+):
+    """Writes the results and timings of a run as json, noting which shard of the
+    suite it ran and the digest of the durations it was balanced with, if any"""
+    report = {
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "elapsed": result.elapsed,
+        "summary": {
+            "tested": result.tested,
+            "passed": result.passed,
+            "failed": result.failed,
+            "errors": result.errors,
+            "timeouts": result.timeouts,
+            "enforced": result.enforced,
+        },
+        "results": [test_case_record(x) for x in test_cases],
+    }
+    if shard is not None:
+        report["shard"] = shard
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(report, indent=2, default=str))
+
+
+def merge_json(paths: Sequence[str | Path]) -> dict:
+    """Combines json reports, e.g. from shards of one suite, into a single report.
+
+    Raises ValueError if the reports come from shards that were split differently,
+    in which case some tests may have run twice and others not at all, or if any
+    shard is missing or given more than once.
+    """
+    reports = [json.loads(Path(path).read_text()) for path in paths]
+    shards = [x["shard"] for x in reports if "shard" in x]
+    if len({(x["count"], x["durations"]) for x in shards}) > 1:
+        raise ValueError(
+            "The shards were split differently: each must be run with the same "
+            "shard count and --shard-durations file"
+        )
+    if shards:
+        count = shards[0]["count"]
+        indexes = sorted(x["index"] for x in shards)
+        if len(shards) != len(reports) or indexes != list(range(1, count + 1)):
+            given = ", ".join(str(x) for x in indexes)
+            raise ValueError(
+                f"Expected a report from each of shards 1 to {count} exactly once, "
+                f"got shards {given}"
+            )
+    summary = {}
+    for report in reports:
+        for key, value in report["summary"].items():
+            summary[key] = summary.get(key, 0) + value
+    return {
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        # shards run side by side, so the suite took as long as the slowest one
+        "elapsed": max((x["elapsed"] for x in reports), default=0.0),
+        "summary": summary,
+        "results": [x for report in reports for x in report["results"]],
+    }
+
+
+def durations(report: dict) -> dict[str, float]:
+    """The duration of each test that was run rather than served from the cache, by
+    test id, to balance shards of later runs with"""
+    return {
+        x["id"]: x["duration"]
+        for x in report["results"]
+        if x.get("id") and x["started_at"] is not None and not x["cached"]
+    }
+
+
+def write_junit(path: str | Path, test_cases: list["TestCase"], result: "RunResult"):
+    """Writes the results and timings of a run as junit xml"""
+    suite = ET.Element(
+        "testsuite",
+        name="sqltest",
+        tests=str(result.tested),
+        failures=str(result.failed),
+        errors=str(result.errors + result.timeouts),
+        time=f"{result.elapsed:.3f}",
+    )
+    for test_case in test_cases:
+        classname = f"{test_case.model.schema}.{test_case.model.name}"
+        if test_case.column:
+            classname += f".{test_case.column.name}"
+        element = ET.SubElement(
+            suite,
+            "testcase",
+            classname=classname,
+            name=test_case.test.name,
+            time=f"{test_case.timings.duration:.3f}",
+        )
+        match test_case.status:
+            case "timeout":
+                ET.SubElement(
+                    element, "error", type="timeout", message=str(test_case.error)
+                )
+            case "error":
+                ET.SubElement(element, "error", message=str(test_case.error))
+            case "fail":
+                if test_case.failures is None:
+                    message = "at least one failing row"
+                else:
+                    message = f"{test_case.failures:,} failing rows"
+                ET.SubElement(element, "failure", message=message)
+            case "not run":
+                ET.SubElement(element, "skipped")
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    ET.ElementTree(suite).write(path, encoding="utf-8", xml_declaration=True)
+
+
+def write_csv(path: str | Path, columns: Sequence[str], rows: Iterable) -> int:
+    """Writes rows to a csv file as they are read, returning how many were written"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    count = 0
+    with path.open("w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def slowest(test_cases: list["TestCase"], n: int) -> str:
+    """A summary of the `n` slowest test cases"""
+    ranked = sorted(test_cases, key=lambda x: x.timings.duration, reverse=True)
+    lines = [f"Slowest {min(n, len(ranked)):,} tests:"]
+    for test_case in ranked[:n]:
+        lines.append(f"  {test_case.timings.duration:9.3f}s  {test_case.name}")
+    return "\n".join(lines)
@@ -1,16 +1,56 @@
-from dataclasses import dataclass
+import asyncio
+from contextlib import aclosing, contextmanager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field, replace
+import hashlib
+from itertools import islice
+import json
 import os
+from pathlib import Path
+import re
+import threading
+import time
 from textwrap import indent
-from typing import Any, Sequence
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Iterator, Sequence
 
 import sqlalchemy as sa
 
-from sqltest.models import Model, ModelColumn, ModelTest, Config
+from sqltest.cache import ResultCache, fingerprint_query
+from sqltest.catalog import Constraints, load_constraints
+from sqltest import materialize, partitions, reports, scheduling
+from sqltest.models import Manifest, Model, ModelColumn, ModelTest, Config
+from sqltest.state import History, Watermarks
 import sqltest.funcs as test_funcs
 from sqltest.utils import Colors
 
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncEngine
 
-@dataclass
+
+@dataclass(slots=True)
+class Timings:
+    """When a test was queued and started (as unix timestamps) and the seconds spent
+    acquiring a connection, executing its query and fetching the result"""
+
+    queued_at: float | None = None
+    started_at: float | None = None
+    connect_time: float = 0.0
+    execute_time: float = 0.0
+    fetch_time: float = 0.0
+
+    @property
+    def duration(self) -> float:
+        return self.connect_time + self.execute_time + self.fetch_time
+
+    @property
+    def wait_time(self) -> float:
+        """Seconds between being queued and starting"""
+        if self.queued_at is None or self.started_at is None:
+            return 0.0
+        return self.started_at - self.queued_at
+
+
+@dataclass(slots=True)
 class TestCase:
     model: Model
     column: ModelColumn | None
@@ -19,22 +59,96 @@ class TestCase:
     passed: bool | None = None
     result: Any = None
     error: Exception | None = None
+    failures: int | None = None
+    cached: bool = False
+    relation: str | None = None
+    relation_params: dict[str, Any] = field(default_factory=dict)
+    timings: Timings = field(default_factory=Timings)
+    timed_out: bool = False
+    failing_rows: Path | None = None
+    enforced: bool = False
+    duplicate_of: "TestCase | None" = field(default=None, repr=False)
+    partition: partitions.Slice | None = None
+    approximate: bool = False
+    slice_of: "TestCase | None" = field(default=None, repr=False)
+    # the relation and params the query was last rendered for, and the query
+    _compiled: tuple[tuple[str | None, dict], test_funcs.Query] | None = field(
+        default=None, init=False, repr=False, compare=False
+    )
+
+    @property
+    def id(self) -> str:
+        """An identifier for the test case that is stable between runs, made of its
+        model, column, test name and a hash of the test's arguments"""
+        kwargs = json.dumps(self.test.kwargs, sort_keys=True, default=str)
+        digest = hashlib.sha1(kwargs.encode()).hexdigest()[:8]
+        column = self.column.name if self.column else ""
+        model = f"{self.model.schema}.{self.model.name}"
+        return f"{model}.{column}.{self.test.name}.{digest}".lower()
+
+    def share(self, other: "TestCase"):
+        """Takes the result of a test case that ran the same query"""
+        self.has_been_run = other.has_been_run
+        self.passed = other.passed
+        self.result = other.result
+        self.error = other.error
+        self.failures = other.failures
+        self.cached = other.cached
+        self.timed_out = other.timed_out
+        self.enforced = other.enforced
+        self.approximate = other.approximate
+        self.relation = other.relation
+        self.relation_params = other.relation_params
+
+    @property
+    def name(self) -> str:
+        """The model, column and test the test case checks"""
+        if self.column:
+            return f"{self.model.schema}.{self.model.name}.{self.column.name}: {self.test.name}"
+        return f"{self.model.schema}.{self.model.name}: {self.test.name}"
+
+    @property
+    def status(self) -> str:
+        if not self.has_been_run:
+            return "not run"
+        if self.timed_out:
+            return "timeout"
+        if self.error is not None:
+            return "error"
+        if self.enforced:
+            return "constraint"
+        return "pass" if self.passed else "fail"
+
+    @property
+    def query(self) -> test_funcs.Query:
+        """The sql and bound parameters associated with the test case, rendered once
+        and reused until the test case is scoped to another relation"""
+        scope = (self.relation, self.relation_params)
+        if self._compiled is not None and self._compiled[0] == scope:
+            return self._compiled[1]
+
+        func = getattr(test_funcs, self.test.name)
+        model = self.model
+        if self.relation is not None:
+            model = model.scoped(self.relation)
+        query = func(model=model, column=self.column, **self.test.kwargs)
+        if self.relation_params:
+            query.params = {**self.relation_params, **query.params}
+        self._compiled = ((self.relation, dict(self.relation_params)), query)
+        return query
 
     @property
     def sql(self) -> str:
         """The sql associated with the test case"""
-        func = getattr(test_funcs, self.test.name)
-        sql = func(model=self.model, column=self.column, **self.test.kwargs)
-        return sql
+        return self.query.sql
 
     def __str__(self):
-        if self.column:
-            stem = f"{self.model.schema}.{self.model.name}.{self.column.name}: {self.test.name}"
-        else:
-            stem = f"{self.model.schema}.{self.model.name}: {self.test.name}"
+        stem = self.name
 
         if self.has_been_run:
-            if self.error is not None:
+            if self.timed_out:
+                msg = f"{stem} - {Colors.WARNING}TIMEOUT{Colors.ENDC}"
+            elif self.error is not None:
                 msg = f"{stem} - {Colors.FAIL}ERROR{Colors.ENDC}"
             elif self.passed:
                 msg = f"{stem} - {Colors.OKCYAN}PASSED{Colors.ENDC}"
@@ -43,11 +157,24 @@ class TestCase:
         else:
             msg = stem
 
+        if self.cached:
+            msg += f" {Colors.LIGHTGRAY}(cached){Colors.ENDC}"
+        elif self.enforced:
+            msg += f" {Colors.LIGHTGRAY}(constraint){Colors.ENDC}"
+        elif self.approximate:
+            msg += f" {Colors.LIGHTGRAY}(approximate){Colors.ENDC}"
+
         if self.test.kwargs:
             msg += f"\n{Colors.LIGHTGRAY} ↳ {self.test.kwargs}{Colors.ENDC}"
 
         return msg
 
+    def release(self):
+        """Drops the raw result and rendered query once the test case has been
+        reported, keeping only what the run summary and reports need"""
+        self.result = None
+        self._compiled = None
+
     def report(self):
         msg = str(self)
         separator = "=" * 48
@@ -62,10 +189,14 @@ class TestCase:
                     f"{Colors.ENDC}"
                 )
             elif self.passed is False:
+                query = self.query
+                sql = query.sql
+                if query.params:
+                    sql += f"\n\nparams: {query.params}"
                 msg += (
                     f"{Colors.FAIL}\n"
                     f"{separator}\n"
-                    f"{indent(self.sql, ' ' * 4)}\n"
+                    f"{indent(sql, ' ' * 4)}\n"
                     f"{separator}"
                     f"{Colors.ENDC}"
                 )
@@ -73,85 +204,1614 @@ class TestCase:
         return msg
 
 
+@dataclass
+class Batch:
+    """A unit of work for the runner: one or more test cases run together.
+
+    `kind` names the runner method that runs the batch, e.g. "fused" for
+    `TestRunner.run_fused`.
+    """
+
+    test_cases: list[TestCase]
+    kind: str = "tests"
+    # test cases whose query is the same as one of `test_cases`, sharing its result
+    duplicates: list[TestCase] = field(default_factory=list)
+
+    @property
+    def members(self) -> list[TestCase]:
+        return self.test_cases + self.duplicates
+
+
+@dataclass
+class RunResult:
+    """Totals for a completed test run"""
+
+    tested: int = 0
+    passed: int = 0
+    failed: int = 0
+    errors: int = 0
+    timeouts: int = 0
+    enforced: int = 0
+    elapsed: float = field(default=0.0, compare=False)
+
+    @property
+    def success(self) -> bool:
+        return self.failed == 0 and self.errors == 0 and self.timeouts == 0
+
+    def add(self, test_case: TestCase):
+        """Count a test case towards the run totals"""
+        if not test_case.has_been_run:
+            return
+        self.tested += 1
+        if test_case.timed_out:
+            self.timeouts += 1
+        elif test_case.error:
+            self.errors += 1
+        elif test_case.passed:
+            self.passed += 1
+            self.enforced += test_case.enforced
+        else:
+            self.failed += 1
+
+
+# the errors drivers raise when the database cancels a query for running past its
+# statement timeout: oracle's call timeout, postgres's query_canceled and mysql's
+# max_execution_time exceeded
+ORACLE_TIMEOUT_CODES = ("DPY-4011", "DPY-4024", "ORA-01013")
+POSTGRES_TIMEOUT_SQLSTATE = "57014"
+MYSQL_TIMEOUT_ERRNO = 3024
+
+
+def is_timeout(error: Exception) -> bool:
+    """Whether `error` is the database cancelling a query that hit its timeout"""
+    orig = getattr(error, "orig", None) or error
+    message = str(orig)
+    if message == "interrupted":
+        # sqlite, once the progress handler aborts the query
+        return True
+    if message.startswith(ORACLE_TIMEOUT_CODES):
+        return True
+    sqlstate = getattr(orig, "sqlstate", None) or getattr(orig, "pgcode", None)
+    if sqlstate == POSTGRES_TIMEOUT_SQLSTATE:
+        return True
+    return bool(orig.args) and orig.args[0] == MYSQL_TIMEOUT_ERRNO
+
+
+# a `:name` bind parameter as sqlalchemy's text() finds them
+BIND_PARAM = re.compile(r"(?<![:\w\\]):(\w+)")
+
+
+def statement(sql: str, params: dict[str, Any]) -> sa.TextClause:
+    """A statement for `sql` in which only the names in `params` are bound.
+
+    Colons anywhere else, e.g. in a string literal of a user's expression, are
+    escaped so that sqlalchemy doesn't take them for parameters.
+    """
+    parts = test_funcs.QUOTED.split(sql)
+    for i, part in enumerate(parts):
+        if i % 2:
+            parts[i] = part.replace(":", "\\:")
+        else:
+            parts[i] = BIND_PARAM.sub(
+                lambda m: m[0] if m[1] in params else "\\" + m[0], part
+            )
+    return sa.text("".join(parts))
+
+
 class TestRunner:
-    def __init__(self, config: Config):
+    def __init__(
+        self,
+        config: Config,
+        threads: int | None = None,
+        fuse: bool | None = None,
+        mode: str | None = None,
+        count_failures: bool | None = None,
+        cache: bool | None = None,
+        refresh: bool = False,
+        full_refresh: bool = False,
+        report_json: str | Path | None = None,
+        junit: str | Path | None = None,
+        slowest: int = 0,
+        time_budget: float | None = None,
+        order: str | None = None,
+        max_per_model: int | None = None,
+        failed_first: bool = False,
+        max_failures: int | None = None,
+        store_failures: str | Path | None = None,
+        store_failures_limit: int = 1000,
+        arraysize: int | None = None,
+        shard: tuple[int, int] | None = None,
+        shard_durations: str | Path | None = None,
+        preflight: bool | None = None,
+        approximate: bool | None = None,
+        approximate_margin: float | None = None,
+        state: str | Path | None = None,
+    ):
         self.config = config
+        self.threads = max(threads or config.threads, 1)
+        self.fuse = config.fuse if fuse is None else fuse
+        self.preflight = config.preflight if preflight is None else preflight
+        self.constraints: Constraints | None = None
+        self.mode = mode or config.mode
+        self.count_failures = (
+            config.count_failures if count_failures is None else count_failures
+        )
+        self.approximate = config.approximate if approximate is None else approximate
+        self.approximate_margin = (
+            config.approximate_margin
+            if approximate_margin is None
+            else approximate_margin
+        )
+        self.use_cache = config.cache.enabled if cache is None else cache
+        self.refresh = refresh
+        self.full_refresh = full_refresh
+        self.report_json = report_json
+        self.junit = junit
+        self.slowest = slowest
+        self.time_budget = time_budget
+        self.deadline = None
+        self.order = order or config.order
+        self.max_per_model = max_per_model or config.max_per_model
+        self.failed_first = failed_first
+        self.max_failures = max_failures
+        self.store_failures = store_failures
+        self.store_failures_limit = store_failures_limit
+        self.arraysize = arraysize or config.source.arraysize or 1000
+        self.shard = shard
+        # durations shared by every shard's process, e.g. written by merge-results,
+        # to balance the shards with; each process's own history differs
+        self.shard_durations = None
+        if shard_durations is not None:
+            self.shard_durations = json.loads(Path(shard_durations).read_text())
+        # the manifest `state:modified` compares model files against: by default
+        # one that records the files as of the last run in which their tests passed
+        self.save_state_changes = state is None
+        if state is None:
+            self.state = Manifest.load(Path(config.target_dir) / "state.pickle")
+        else:
+            self.state = Manifest.load(state, strict=True)
         self._engine = None
+        self._cache = None
+        self._watermarks = None
+        self._history = None
+        # slices of partitioned test cases, how many of them are still to finish
+        # and the duplicates waiting on their results, by id of the test case
+        self._slices: dict[int, list[TestCase]] = {}
+        self._remaining: dict[int, int] = {}
+        self._duplicates: dict[int, list[TestCase]] = {}
+        self._model_state = {}
+        self._model_locks = {}
+        self._lock = threading.Lock()
+        # guards creating the engine, cache, history and watermarks, which workers
+        # may all ask for at once
+        self._create_lock = threading.Lock()
+        # connections pinned to worker threads, see `pinned`
+        self._local = threading.local()
+
+    @property
+    def url(self) -> str:
+        """The data source url, read from the environment if it names a variable"""
+        url = self.config.source.url
+        if url.startswith("$"):
+            url = os.environ[url[1:]]
+        return url
+
+    def engine_kwargs(self, url: sa.URL, **defaults) -> dict[str, Any]:
+        """Arguments for creating an engine for the source: `defaults`, overridden
+        by the source's pool settings and then by its `kwargs`.
+
+        Default pool sizes are left out when the engine's pool doesn't take them,
+        e.g. the `NullPool` some drivers use.
+        """
+        source = self.config.source
+        poolclass = source.kwargs.get("poolclass") or url.get_dialect().get_pool_class(
+            url
+        )
+        accepted = sa.util.get_cls_kwargs(poolclass)
+        kwargs = {k: v for k, v in defaults.items() if k in accepted}
+        settings = {
+            "pool_size": source.pool_size,
+            "max_overflow": source.max_overflow,
+            "pool_recycle": source.pool_recycle,
+        }
+        kwargs.update({k: v for k, v in settings.items() if v is not None})
+        if source.pool_pre_ping:
+            kwargs["pool_pre_ping"] = True
+        kwargs.update(source.kwargs)
+        return kwargs
+
+    def configure(self, engine: sa.Engine):
+        """Adds the source's session initialization and fetch sizes to an engine"""
+        source = self.config.source
+
+        if source.session_init:
+
+            @sa.event.listens_for(engine, "connect")
+            def init_session(dbapi_connection, connection_record):
+                cursor = dbapi_connection.cursor()
+                try:
+                    for sql in source.session_init:
+                        cursor.execute(sql)
+                finally:
+                    cursor.close()
+                # keeps settings made in a transaction from being rolled back when
+                # the connection is returned to the pool
+                dbapi_connection.commit()
+
+        fetch_sizes = {
+            "arraysize": source.arraysize,
+            "prefetchrows": source.prefetchrows,
+        }
+        fetch_sizes = {k: v for k, v in fetch_sizes.items() if v is not None}
+        if fetch_sizes:
+
+            @sa.event.listens_for(engine, "before_cursor_execute")
+            def set_fetch_sizes(conn, cursor, statement, params, context, many):
+                if context is not None and "yield_per" in context.execution_options:
+                    return
+                for name, value in fetch_sizes.items():
+                    if hasattr(cursor, name):
+                        setattr(cursor, name, value)
 
     @property
     def engine(self) -> sa.Engine:
         if self._engine is None:
-            url = self.config.source.url
-            if url.startswith("$"):
-                url = os.environ[url[1:]]
-            self._engine = sa.create_engine(url)
+            with self._create_lock:
+                if self._engine is None:
+                    defaults = {}
+                    if self.threads > 1:
+                        # make sure every worker can check out a connection at once
+                        defaults["pool_size"] = self.threads
+                    url = sa.make_url(self.url)
+                    kwargs = self.engine_kwargs(url, **defaults)
+                    engine = sa.create_engine(url, **kwargs)
+                    self.configure(engine)
+                    self._engine = engine
         return self._engine
 
-    def run_test(self, test_case: TestCase):
+    def memoize(self, model: Model, name: str, compute: Callable[[], Any]) -> Any:
+        """Computes a value for a model once per runner, even when several workers
+        ask for it at the same time"""
+        key = (id(model), name)
+        with self._lock:
+            model_lock = self._model_locks.setdefault(key, threading.Lock())
+
+        with model_lock:
+            if key not in self._model_state:
+                self._model_state[key] = compute()
+
+        return self._model_state[key]
+
+    @property
+    def watermarks(self) -> Watermarks:
+        if self._watermarks is None:
+            with self._create_lock:
+                if self._watermarks is None:
+                    path = Path(self.config.target_dir) / "watermarks.json"
+                    self._watermarks = Watermarks(path)
+        return self._watermarks
+
+    @property
+    def history(self) -> History:
+        if self._history is None:
+            with self._create_lock:
+                if self._history is None:
+                    path = Path(self.config.target_dir) / "history.json"
+                    self._history = History(path)
+        return self._history
+
+    def save_history(self, test_cases: list[TestCase]):
+        """Records how each test case that ran ended, and how long it took if its
+        query was executed"""
+        ran = [x for x in test_cases if x.has_been_run]
+        for test_case in ran:
+            duration = None
+            if test_case.timings.started_at is not None:
+                duration = test_case.timings.duration
+            self.history.record(test_case.id, test_case.status, duration)
+        if ran:
+            self.history.save()
+
+    def high_watermark(self, model: Model) -> Any:
+        """The current highest value of an incremental model's watermark column"""
+
+        def compute():
+            column = model.incremental.column
+            sql = f"select max({column}) from {model.schema}.{model.name}"
+            try:
+                with self.engine.connect() as db:
+                    return db.exec_driver_sql(sql).scalar()
+            except Exception:
+                return None
+
+        return self.memoize(model, "high_watermark", compute)
+
+    def scope(self, test_case: TestCase, table: str | None = None):
+        """Restricts a row-level test to its slice of a partitioned model, and on an
+        incremental model to the rows added since the last successful run.
+
+        Tests select from `table` in place of the model's own table, if given.
+        """
+        model = test_case.model
+        if not test_funcs.is_row_level(test_case.test.name):
+            return
+
+        table = table or f"{model.schema}.{model.name}"
+        conditions = []
+        params = {}
+
+        if test_case.partition is not None:
+            if test_case.partition.clause:
+                table += f" {test_case.partition.clause}"
+            if test_case.partition.condition:
+                conditions.append(test_case.partition.condition)
+                params.update(test_case.partition.params)
+
+        high = None
+        if model.incremental is not None:
+            # read before the tests run even on a full refresh, so that rows added
+            # while they run are tested by the next run
+            high = self.high_watermark(model)
+        if high is not None and not self.full_refresh:
+            column = model.incremental.column
+            conditions.append(f"{column} <= :wm_high")
+            params["wm_high"] = high
+
+            low = self.watermarks.get(model.schema, model.name, column)
+            if low is not None:
+                conditions.insert(-1, f"{column} > :wm_low")
+                params["wm_low"] = low
+
+        if conditions:
+            where = " and ".join(conditions)
+            test_case.relation = f"(select * from {table} where {where})"
+        elif test_case.partition is not None:
+            test_case.relation = table
+        test_case.relation_params = params
+
+    @staticmethod
+    def passed_models(test_cases: list[TestCase]) -> list[Model]:
+        """The models whose tests all ran in this run and passed.
+
+        Models some of whose tests were left out, through selectors or sharding,
+        aren't included, as the tests left out may not have passed.
+        """
+        models = {}
+        for test_case in test_cases:
+            model = test_case.model
+            _, count, passed = models.get(id(model), (model, 0, True))
+            passed = passed and test_case.has_been_run and bool(test_case.passed)
+            models[id(model)] = (model, count + 1, passed)
+
+        return [
+            model
+            for model, count, passed in models.values()
+            if passed
+            and count == len(model.tests) + sum(len(x.tests) for x in model.columns)
+        ]
+
+    def save_watermarks(self, test_cases: list[TestCase]):
+        """Advances the watermark of each incremental model whose tests all ran and
+        passed, or the rows a partial run skips would never be checked by the tests
+        it left out"""
+        if not any(x.model.incremental is not None for x in test_cases):
+            return
+
+        for model in self.passed_models(test_cases):
+            if model.incremental is None:
+                continue
+            high = self.high_watermark(model)
+            if high is not None:
+                column = model.incremental.column
+                self.watermarks.set(model.schema, model.name, column, high)
+        self.watermarks.save()
+
+    def save_state(self, test_cases: list[TestCase]):
+        """Records the files of the models whose tests all passed, so that
+        `state:modified` selects them again only once they change"""
+        manifest = self.config.manifest
+        if self.state is None or not self.save_state_changes or manifest is None:
+            return
+
+        passed = {id(x) for x in self.passed_models(test_cases)}
+        self.state.update(
+            {k: v for k, v in manifest.entries.items() if id(v.model) in passed}
+        )
+        self.state.save()
+
+    @property
+    def cache(self) -> ResultCache:
+        if self._cache is None:
+            with self._create_lock:
+                if self._cache is None:
+                    path = Path(self.config.target_dir) / "cache.db"
+                    self._cache = ResultCache(path)
+        return self._cache
+
+    def fingerprint(self, model: Model) -> str | None:
+        """Fingerprints the model's table so that cached results can be reused
+        until it changes.
+
+        Returns None if the model has no fingerprint or it can't be computed. Each
+        model is fingerprinted at most once per runner.
+        """
+        strategy = model.fingerprint or self.config.cache.fingerprint
+        if not strategy:
+            return None
+
+        def compute():
+            query = fingerprint_query(model.schema, model.name, strategy)
+            try:
+                with self.engine.connect() as db:
+                    result = db.execute(
+                        statement(query.sql, query.params), query.params
+                    )
+                    row = result.fetchone()
+            except Exception:
+                return None
+            return None if row is None else json.dumps(list(row), default=str)
+
+        return self.memoize(model, "fingerprint", compute)
+
+    def cache_key(self, test_case: TestCase) -> str | None:
+        """The key a test case's result is cached under, if it can be cached"""
+        fingerprint = self.fingerprint(test_case.model)
+        if fingerprint is None:
+            return None
+        try:
+            query = test_case.query
+        except Exception:
+            return None
+        return ResultCache.key(query.sql, query.params, fingerprint)
+
+    def load_constraints(self, test_cases: list[TestCase]):
+        """Reads the constraints enforced on the tested models from the catalog"""
+        models = list({id(x.model): x.model for x in test_cases}.values())
+        try:
+            self.constraints = load_constraints(self.engine, models)
+        except Exception as e:
+            print(f"Couldn't read constraints, running every test: {e}")
+
+    def enforce(self, test_case: TestCase) -> bool:
+        """Passes a test case without running it if a database constraint already
+        guarantees it"""
+        if self.constraints is None:
+            return False
+        if not self.constraints.enforces(
+            test_case.model, test_case.column, test_case.test
+        ):
+            return False
+        test_case.passed = True
+        test_case.failures = 0
+        test_case.enforced = True
+        test_case.has_been_run = True
+        return True
+
+    def prepare(self, batch: Batch) -> list[TestCase]:
+        """Gets a batch's test cases ready to run, returning those that still need
+        to be run once constraints and cached results have been applied"""
+        for test_case in batch.test_cases:
+            self.scope(test_case)
+
+        candidates = [x for x in batch.test_cases if not self.enforce(x)]
+        if not self.use_cache:
+            return candidates
+
+        pending = []
+        for test_case in candidates:
+            key = self.cache_key(test_case)
+            stored = None
+            if key is not None and not self.refresh:
+                stored = self.cache.get(key)
+            if stored is None:
+                pending.append(test_case)
+                continue
+            test_case.passed = stored["passed"]
+            test_case.failures = stored["failures"]
+            test_case.cached = True
+            test_case.has_been_run = True
+
+        return pending
+
+    def store(self, test_cases: list[TestCase]):
+        """Caches the results of test cases that have been run"""
+        if not self.use_cache:
+            return
+
+        for test_case in test_cases:
+            if not test_case.has_been_run or test_case.error is not None:
+                continue
+            # a probed failure has no count to serve to runs that count failures
+            if test_case.approximate or test_case.failures is None:
+                continue
+            key = self.cache_key(test_case)
+            if key is not None:
+                self.cache.put(key, test_case.passed, test_case.failures)
+
+    def share(self, batch: Batch):
+        """Copies the results of a batch's test cases to their duplicates"""
+        for test_case in batch.duplicates:
+            test_case.share(test_case.duplicate_of)
+
+    def run_batch(self, batch: Batch):
+        """Runs a batch of test cases, reusing cached results where they exist"""
+        pending = self.prepare(batch)
+        if pending:
+            getattr(self, f"run_{batch.kind}")(pending)
+        self.store(pending)
+        self.share(batch)
+
+    def probing(self, test_case: TestCase) -> bool:
+        """Whether a test case stops at its first failing row"""
+        return (test_case.test.mode or self.mode) == "probe"
+
+    def compile(
+        self, test_case: TestCase, probe: bool | None = None
+    ) -> test_funcs.Query:
+        """The query run for a test case, probing for a failing row rather than
+        counting them if `probe`, which defaults to the test's mode"""
+        query = test_case.query
+        if probe is None:
+            probe = self.probing(test_case)
+        if probe:
+            query = test_funcs.probe(query, self.engine.dialect.name)
+        if test_case.model.parallel:
+            query = test_funcs.hinted(query, f"parallel({test_case.model.parallel})")
+        return query
+
+    def timeout(self, test_case: TestCase) -> float | None:
+        """Seconds a test case's query may run for, taking the test's and model's
+        `timeout` and the time left in the run's budget into account"""
+        timeout = test_case.test.timeout or test_case.model.timeout
+        if self.deadline is not None:
+            remaining = self.deadline - time.monotonic()
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        return timeout
+
+    def fused_timeout(self, test_cases: list[TestCase]) -> float | None:
+        """Seconds a fused query may run for: the longest of its tests' timeouts"""
+        timeouts = [self.timeout(x) for x in test_cases]
+        return None if None in timeouts else max(timeouts)
+
+    @contextmanager
+    def statement_timeout(self, db: sa.Connection, timeout: float | None):
+        """Has the database cancel queries run on the connection that take longer
+        than `timeout` seconds.
+
+        The connection's own timeout, e.g. one set by the source's `session_init`,
+        is restored afterwards.
+        """
+        if timeout is None:
+            yield
+            return
+
+        ms = max(int(timeout * 1000), 1)
+        driver_connection = db.connection.driver_connection
+        match db.dialect.name:
+            case "oracle":
+                previous = driver_connection.call_timeout
+                driver_connection.call_timeout = ms
+                try:
+                    yield
+                finally:
+                    driver_connection.call_timeout = previous
+            case "postgresql":
+                # scoped to the transaction, which is rolled back when the connection
+                # is returned; resetting it after an error would fail, as postgres
+                # rejects statements in a transaction that has been aborted
+                db.exec_driver_sql(f"set local statement_timeout = {ms}")
+                yield
+            case "mysql":
+                previous = db.exec_driver_sql(
+                    "select @@session.max_execution_time"
+                ).scalar()
+                db.exec_driver_sql(f"set session max_execution_time = {ms}")
+                try:
+                    yield
+                finally:
+                    db.exec_driver_sql(
+                        f"set session max_execution_time = {int(previous)}"
+                    )
+            case "sqlite":
+                deadline = time.monotonic() + timeout
+                driver_connection.set_progress_handler(
+                    lambda: time.monotonic() > deadline, 1000
+                )
+                try:
+                    yield
+                finally:
+                    driver_connection.set_progress_handler(None, 1000)
+            case _:
+                yield
+
+    def record(
+        self,
+        test_case: TestCase,
+        result: Any = None,
+        error: Exception | None = None,
+    ):
+        """Records the outcome of running a test case's query.
+
+        An error from the database cancelling the query for running past its timeout
+        is recorded as a timeout.
+        """
+        test_case.has_been_run = True
+        if error is not None:
+            test_case.error = error
+            test_case.passed = False
+            test_case.timed_out = is_timeout(error)
+            return
+
+        test_case.result = result
+        test_case.passed = result.failures == 0
+        # a probe only tells us whether there is at least one failure
+        if not self.probing(test_case) or test_case.passed:
+            test_case.failures = result.failures
+
+    @contextmanager
+    def connection(self) -> Iterator[sa.Connection]:
+        """A connection to run a query on: the one pinned to the current thread, if
+        there is one, or else one checked out of the pool"""
+        pinned = getattr(self._local, "connection", None)
+        if pinned is None:
+            with self.engine.connect() as db:
+                yield db
+            return
+
+        try:
+            yield pinned
+        finally:
+            # ends the query's transaction, which an error may have aborted, while
+            # keeping the session and its temporary tables
+            pinned.rollback()
+
+    @contextmanager
+    def pinned(self, db: sa.Connection):
+        """Runs the current thread's queries on `db` rather than on pooled
+        connections"""
+        self._local.connection = db
+        try:
+            yield
+        finally:
+            self._local.connection = None
+
+    def run_materialized(self, test_cases: list[TestCase]):
+        """Runs the tests on a model against a snapshot of it.
+
+        The model, typically an expensive view, is copied into a temporary table
+        once, on a connection that all of its tests are then run on, rather than
+        evaluated again by each test. The tests' relations are restored afterwards
+        so that their results are cached and reported against the model itself.
+        """
+
+        def run_batches():
+            for batch in self.batch(test_cases):
+                getattr(self, f"run_{batch.kind}")(batch.test_cases)
+
+        model = test_cases[0].model
+        dialect = self.engine.dialect.name
+        snapshot = materialize.snapshot(dialect, f"{model.schema}.{model.name}")
+        if snapshot is None:
+            print(
+                f"Couldn't materialize {model.schema}.{model.name}: temporary tables "
+                f"aren't supported on {dialect}"
+            )
+            run_batches()
+            return
+
         with self.engine.connect() as db:
             try:
-                result = db.exec_driver_sql(test_case.sql).fetchone()
+                db.exec_driver_sql(snapshot.create)
+                db.commit()
             except Exception as e:
-                test_case.has_been_run = True
-                test_case.error = e
-                test_case.passed = False
+                print(f"Couldn't materialize {model.schema}.{model.name}: {e}")
+                db.rollback()
+                snapshot = None
+
+            if snapshot is None:
+                run_batches()
+                return
+
+            scopes = [(x.relation, x.relation_params) for x in test_cases]
+            try:
+                for test_case in test_cases:
+                    self.scope(test_case, snapshot.table)
+                    if test_case.relation is None:
+                        test_case.relation = snapshot.table
+                with self.pinned(db):
+                    run_batches()
+            finally:
+                for test_case, (relation, params) in zip(test_cases, scopes):
+                    test_case.relation = relation
+                    test_case.relation_params = params
+                db.exec_driver_sql(snapshot.drop)
+                db.commit()
+
+    def fetch_row(
+        self, query: test_funcs.Query, timings: Timings, timeout: float | None = None
+    ) -> Any:
+        """Runs a query and returns its first row, timing each step"""
+        rows = self.fetch_rows(query, timings, timeout)
+        return rows[0] if rows else None
+
+    def fetch_rows(
+        self, query: test_funcs.Query, timings: Timings, timeout: float | None = None
+    ) -> list[Any]:
+        """Runs a query and returns its rows, timing each step"""
+        timings.started_at = time.time()
+        start = time.perf_counter()
+        with self.connection() as db:
+            connected = time.perf_counter()
+            timings.connect_time = connected - start
+            with self.statement_timeout(db, timeout):
+                try:
+                    result = db.execute(
+                        statement(query.sql, query.params), query.params
+                    )
+                finally:
+                    executed = time.perf_counter()
+                    timings.execute_time = executed - connected
+                rows = result.fetchall()
+                timings.fetch_time = time.perf_counter() - executed
+        return rows
+
+    def store_failing_rows(self, test_case: TestCase):
+        """Writes up to `store_failures_limit` of a failing test's rows to a csv file
+        in the `store_failures` directory.
+
+        The rows come from the test's query before it's wrapped in `count(*)`, read
+        through a server-side cursor `arraysize` rows at a time, so only one batch
+        of rows is held in memory however many rows fail.
+        """
+        query = test_case.query
+        if query.inner is None:
+            return
+
+        path = Path(self.store_failures) / f"{test_case.id}.csv"
+        options = {"stream_results": True, "yield_per": self.arraysize}
+        with self.engine.connect().execution_options(**options) as db:
+            result = db.execute(statement(query.inner, query.params), query.params)
+            try:
+                rows = islice(result, self.store_failures_limit)
+                count = reports.write_csv(path, list(result.keys()), rows)
+            finally:
+                result.close()
+        test_case.failing_rows = path
+        print(f"Stored {count:,} failing rows for {test_case.name} in {path}")
+
+    def expire(self, test_case: TestCase):
+        """Records a test case that couldn't start before the run's time budget ran
+        out"""
+        test_case.has_been_run = True
+        test_case.passed = False
+        test_case.timed_out = True
+        test_case.error = TimeoutError("The run's time budget was exhausted")
+
+    def approx_query(self, test_case: TestCase) -> test_funcs.Query | None:
+        """The query estimating whether a uniqueness test passes, if the test is to
+        be checked approximately first"""
+        approximate = test_case.test.approximate
+        if approximate is None:
+            approximate = self.approximate
+        function = test_funcs.APPROX_COUNT_DISTINCT.get(self.engine.dialect.name)
+        if not approximate or function is None:
+            return None
+
+        match test_case.test.name:
+            case "unique":
+                columns = [test_case.column.name]
+            case "unique_combination_of_columns":
+                columns = test_case.test.kwargs["columns"]
+            case _:
+                return None
+
+        model = test_case.model
+        if test_case.relation is not None:
+            model = model.scoped(test_case.relation)
+        query = test_funcs.approx_unique(model, columns, function)
+        query.params.update(test_case.relation_params)
+        return query
+
+    def approx_passes(self, test_case: TestCase, row: Any) -> bool:
+        """Whether an estimate of a key's distinct values clears its number of rows
+        by enough to pass the test without counting duplicates exactly.
+
+        `approximate_margin` is the relative error expected of the estimate: it
+        passes when it is at least `records * (1 + margin)`. An estimate within the
+        margin of the row count, or below it, can't tell whether there are
+        duplicates, so the exact test is run, as it is when the key is null in more
+        than one row. A test only ever fails on the exact result.
+        """
+        records, non_null, estimate = row
+        if test_case.test.name == "unique":
+            nulls = records - non_null
+            if nulls > 1:
+                return False
+            # all of the nulls make up one group
+            estimate += nulls
+        if not records:
+            return True
+        return estimate >= records * (1 + self.approximate_margin)
+
+    def record_approximate(
+        self, test_case: TestCase, row: Any, timings: Timings
+    ) -> bool:
+        """Passes a uniqueness test whose estimate shows no duplicates, returning
+        whether it passed"""
+        if row is None or not self.approx_passes(test_case, row):
+            return False
+        test_case.timings = timings
+        test_case.result = row
+        test_case.passed = True
+        test_case.failures = 0
+        test_case.approximate = True
+        test_case.has_been_run = True
+        return True
+
+    @staticmethod
+    def add_estimate_timings(test_case: TestCase, timings: Timings | None):
+        """Counts the time spent on an estimate towards the exact test it led to"""
+        if timings is None or timings.started_at is None:
+            return
+        test_case.timings.started_at = timings.started_at
+        test_case.timings.connect_time += timings.connect_time
+        test_case.timings.execute_time += timings.execute_time
+        test_case.timings.fetch_time += timings.fetch_time
+
+    def needs_count(self, test_case: TestCase) -> bool:
+        """Whether a test case's probe found a failing row that is still to be
+        counted"""
+        return (
+            self.count_failures
+            and test_case.passed is False
+            and test_case.error is None
+            and test_case.failures is None
+        )
+
+    @staticmethod
+    def record_count(test_case: TestCase, row: Any, timings: Timings):
+        """Records the failures counted after a probe, and the time spent counting"""
+        test_case.failures = row.failures
+        test_case.timings.connect_time += timings.connect_time
+        test_case.timings.execute_time += timings.execute_time
+        test_case.timings.fetch_time += timings.fetch_time
+
+    def count(self, test_case: TestCase):
+        """Counts the failing rows of a test case whose probe failed. If counting
+        fails, the test case stays failed with an unknown number of failures."""
+        timeout = self.timeout(test_case)
+        if timeout is not None and timeout <= 0:
+            return
+        timings = Timings()
+        try:
+            row = self.fetch_row(self.compile(test_case, probe=False), timings, timeout)
+        except Exception:
+            return
+        self.record_count(test_case, row, timings)
+
+    def run_test(self, test_case: TestCase):
+        timeout = self.timeout(test_case)
+        if timeout is not None and timeout <= 0:
+            self.expire(test_case)
+            return
+
+        estimate_timings = None
+        approx_query = self.approx_query(test_case)
+        if approx_query is not None:
+            estimate_timings = replace(test_case.timings)
+            try:
+                row = self.fetch_row(approx_query, estimate_timings, timeout)
+            except Exception:
+                row = None
+            if self.record_approximate(test_case, row, estimate_timings):
+                return
+            timeout = self.timeout(test_case)
+
+        try:
+            query = self.compile(test_case)
+            row = self.fetch_row(query, test_case.timings, timeout)
+        except Exception as e:
+            self.record(test_case, error=e)
+        else:
+            self.record(test_case, row)
+            if self.needs_count(test_case):
+                self.count(test_case)
+        self.add_estimate_timings(test_case, estimate_timings)
+
+    def run_tests(self, test_cases: list[TestCase]):
+        """Runs test cases one at a time"""
+        for test_case in test_cases:
+            self.run_test(test_case)
+
+    def run_fused(self, test_cases: list[TestCase]):
+        """Runs row-level tests on a single model in one scan of its table.
+
+        If the fused query fails, the tests are re-run one at a time so that an error
+        in one of them doesn't fail the others.
+        """
+        timeout = self.fused_timeout(test_cases)
+        if timeout is not None and timeout <= 0:
+            for test_case in test_cases:
+                self.expire(test_case)
+            return
+
+        timings = replace(test_cases[0].timings)
+        try:
+            query = self.fused_query(test_cases)
+            row = self.fetch_row(query, timings, timeout)
+        except Exception:
+            row = None
+
+        if row is None:
+            self.run_tests(test_cases)
+        else:
+            self.record_fused(test_cases, row, timings)
+
+    def fused_query(self, test_cases: list[TestCase]) -> test_funcs.Query:
+        """The single-scan query for row-level tests on one model"""
+        model = test_cases[0].model
+        if test_cases[0].relation is not None:
+            model = model.scoped(test_cases[0].relation)
+        query = test_funcs.fused(model, [(x.column, x.test) for x in test_cases])
+        query.params.update(test_cases[0].relation_params)
+        if model.parallel:
+            query = test_funcs.hinted(query, f"parallel({model.parallel})")
+        return query
+
+    def record_fused(self, test_cases: list[TestCase], row: Any, timings: Timings):
+        """Splits the row returned by a fused query into per-test results, each of
+        which shares the query's timings"""
+        for test_case, failures in zip(test_cases, row):
+            test_case.timings = replace(timings, queued_at=test_case.timings.queued_at)
+            # sum() over an empty table is null
+            failures = failures or 0
+            test_case.result = row
+            test_case.failures = failures
+            test_case.passed = failures == 0
+            test_case.has_been_run = True
+
+    @staticmethod
+    def relationship_target(test_case: TestCase) -> tuple[str, str] | None:
+        """The parent table and field a `relationships` test checks against, if it
+        can be batched with other tests on the same target"""
+        if test_case.test.name != "relationships" or test_case.column is None:
+            return None
+        kwargs = test_case.test.kwargs
+        if kwargs.get("where") or "to" not in kwargs or "field" not in kwargs:
+            return None
+        return kwargs["to"].lower(), kwargs["field"].lower()
+
+    def run_related(self, test_cases: list[TestCase]):
+        """Runs `relationships` tests pointing at the same parent table and field in
+        one query, falling back to running them one at a time if it fails"""
+        timeout = self.fused_timeout(test_cases)
+        if timeout is not None and timeout <= 0:
+            for test_case in test_cases:
+                self.expire(test_case)
+            return
+
+        timings = replace(test_cases[0].timings)
+        try:
+            query = self.related_query(test_cases)
+            rows = self.fetch_rows(query, timings, timeout)
+        except Exception:
+            self.run_tests(test_cases)
+        else:
+            self.record_related(test_cases, rows, timings)
+
+    def related_query(self, test_cases: list[TestCase]) -> test_funcs.Query:
+        """The query for a batch of `relationships` tests on the same target.
+
+        Each test's relation, which may be scoped to new rows or a partition, has
+        its parameters renamed so that they don't clash with the other tests'.
+        """
+        tests = []
+        params = {}
+        for i, test_case in enumerate(test_cases):
+            model = test_case.model
+            if test_case.relation is not None:
+                relation = test_case.relation
+                for name, value in test_case.relation_params.items():
+                    relation = re.sub(rf":{name}\b", f":{name}_{i}", relation)
+                    params[f"{name}_{i}"] = value
+                model = model.scoped(relation)
+            tests.append((model, test_case.column))
+
+        kwargs = test_cases[0].test.kwargs
+        query = test_funcs.related(tests, kwargs["to"], kwargs["field"])
+        query.params.update(params)
+        return query
+
+    def record_related(
+        self, test_cases: list[TestCase], rows: list[Any], timings: Timings
+    ):
+        """Splits the rows returned by a batch of `relationships` tests into
+        per-test results, each of which shares the query's timings"""
+        failures = {test_id: count for test_id, count in rows}
+        for i, test_case in enumerate(test_cases):
+            test_case.timings = replace(timings, queued_at=test_case.timings.queued_at)
+            test_case.failures = failures.get(i, 0)
+            test_case.passed = test_case.failures == 0
+            test_case.has_been_run = True
+
+    def dedupe_key(self, test_case: TestCase) -> str | None:
+        """Identifies the work a test case does: its normalized query, and the model
+        settings that change how the query is run.
+
+        Row-level tests are identified by the rows they fail, as their single-scan
+        query, so a model-level test matches a column-level test with the same
+        condition.
+        """
+        model = test_case.model
+        try:
+            if test_funcs.is_fusable(test_case.test.name):
+                query = test_funcs.fused(model, [(test_case.column, test_case.test)])
             else:
-                test_case.result = result
-                test_case.passed = result.failures == 0
-                test_case.has_been_run = True
+                query = test_case.query
+        except Exception:
+            return None
+        test = test_case.test
+        settings = [test.mode, test.timeout, test.approximate, model.timeout]
+        if model.incremental is not None and test_funcs.is_row_level(
+            test_case.test.name
+        ):
+            settings.append(model.incremental.column)
+        payload = [test_funcs.normalize_sql(query.sql), query.params, settings]
+        return json.dumps(payload, sort_keys=True, default=str)
 
-    def gather_test_cases(self, models: Sequence[str] | None = None) -> list[TestCase]:
-        test_cases = []
+    def dedupe(self, test_cases: list[TestCase]) -> list[TestCase]:
+        """Returns the distinct test cases, marking the rest as duplicates of the
+        first test case that runs the same query"""
+        first = {}
+        distinct = []
+        for test_case in test_cases:
+            key = self.dedupe_key(test_case)
+            if key is None:
+                distinct.append(test_case)
+                continue
+            original = first.setdefault(key, test_case)
+            if original is test_case:
+                distinct.append(test_case)
+            else:
+                test_case.duplicate_of = original
 
-        if models:
-            models_to_test = list(
-                filter(lambda x: x.name in models, self.config.models)
+        duplicates = [x for x in test_cases if x.duplicate_of is not None]
+        if duplicates:
+            print(
+                f"{Colors.WARNING}Found {len(duplicates):,} duplicate tests, which "
+                f"will share the result of the first test with the same query:"
+                f"{Colors.ENDC}"
             )
+            for test_case in duplicates:
+                print(f"  {test_case.name} (same as {test_case.duplicate_of.name})")
+        return distinct
+
+    def slices(self, model: Model) -> list[partitions.Slice]:
+        """The slices a partitioned model's row-level tests are split into"""
+
+        def compute():
+            try:
+                return partitions.slices(self.engine, model, model.partition_by)
+            except Exception as e:
+                print(f"Couldn't partition {model.schema}.{model.name}: {e}")
+                return []
+
+        return self.memoize(model, "slices", compute)
+
+    def fan_out(self, test_case: TestCase) -> list[TestCase]:
+        """Splits a row-level test on a partitioned model into a test case per slice
+        of the model, which can run side by side"""
+        model = test_case.model
+        if model.partition_by is None:
+            return [test_case]
+        if not test_funcs.is_row_level(test_case.test.name):
+            return [test_case]
+        slices = self.slices(model)
+        if not slices:
+            return [test_case]
+
+        parts = [
+            TestCase(model, test_case.column, test_case.test, partition=x)
+            for x in slices
+        ]
+        for part in parts:
+            part.slice_of = test_case
+        self._slices[id(test_case)] = parts
+        return parts
+
+    def plan(self, test_cases: list[TestCase]) -> list[Batch]:
+        """Splits test cases into the batches of work the runner will execute.
+
+        Test cases that run the same query as an earlier one share its result rather
+        than being run again, and tests on partitioned models are run as a test case
+        per slice.
+        """
+        work = [
+            x for test_case in self.dedupe(test_cases) for x in self.fan_out(test_case)
+        ]
+        batches = []
+        snapshots = {}
+        unmaterialized = []
+        for test_case in work:
+            model = test_case.model
+            if model.materialize is None:
+                unmaterialized.append(test_case)
+                continue
+            if id(model) not in snapshots:
+                snapshots[id(model)] = Batch([], "materialized")
+                batches.append(snapshots[id(model)])
+            snapshots[id(model)].test_cases.append(test_case)
+        batches += self.batch(unmaterialized)
+        batch_of = {id(x): batch for batch in batches for x in batch.test_cases}
+        for test_case in test_cases:
+            original = test_case.duplicate_of
+            if original is None:
+                continue
+            if id(original) in self._slices:
+                self._duplicates.setdefault(id(original), []).append(test_case)
+            else:
+                batch_of[id(original)].duplicates.append(test_case)
+        return batches
+
+    def batch(self, test_cases: list[TestCase]) -> list[Batch]:
+        """Groups test cases into batches. When `fuse` is set, row-level tests on
+        each model are fused into one scan, and `relationships` tests on the same
+        parent table and field are run together."""
+        if not self.fuse:
+            return [Batch([x]) for x in test_cases]
+
+        batches = []
+        fused = {}
+        related = {}
+        for test_case in test_cases:
+            target = self.relationship_target(test_case)
+            if target is not None:
+                if target not in related:
+                    related[target] = Batch([], "related")
+                    batches.append(related[target])
+                related[target].test_cases.append(test_case)
+                continue
+
+            if not test_funcs.is_fusable(test_case.test.name):
+                batches.append(Batch([test_case]))
+                continue
+
+            partition = test_case.partition
+            key = (id(test_case.model), partition.name if partition else None)
+            if key not in fused:
+                fused[key] = Batch([], "fused")
+                batches.append(fused[key])
+            fused[key].test_cases.append(test_case)
+
+        for batch in [*fused.values(), *related.values()]:
+            if len(batch.test_cases) == 1:
+                batch.kind = "tests"
+
+        return batches
+
+    def schedule(self, batches: list[Batch]) -> list[Batch]:
+        """Orders batches for execution: as configured, or longest first using the
+        durations recorded in previous runs. With `failed_first`, batches with a test
+        that didn't pass last time go ahead of the rest."""
+        if self.order == "longest":
+            batches = scheduling.longest_first(batches, self.history.durations)
+        if self.failed_first:
+            batches = scheduling.failed_first(batches, self.history.failing)
+        return batches
+
+    def should_stop(self, result: RunResult) -> bool:
+        """Whether the run has seen `max_failures` unsuccessful tests"""
+        if not self.max_failures:
+            return False
+        return result.tested - result.passed >= self.max_failures
+
+    def queue(self, test_cases: list[TestCase]) -> list[Batch]:
+        """Plans and orders the batches to run, marking their test cases as queued
+        and starting the clock on the run's time budget"""
+        if self.preflight:
+            self.load_constraints(test_cases)
+        batches = self.schedule(self.plan(test_cases))
+        if self.time_budget is not None:
+            self.deadline = time.monotonic() + self.time_budget
+        queued_at = time.time()
+        for batch in batches:
+            for test_case in batch.members:
+                test_case.timings.queued_at = queued_at
+        for test_case in test_cases:
+            test_case.timings.queued_at = queued_at
+        return batches
+
+    def iter_test_cases(
+        self, models: Sequence[str] | None = None
+    ) -> Iterator[TestCase]:
+        """Yields the test cases of the models matching the `models` selectors, or of
+        all models, as they're needed. See `Registry.select` for the selectors."""
+        if models:
+            selected = self.config.registry.select(models, self.state)
         else:
-            models_to_test = self.config.models
+            selected = [(x, None) for x in self.config.models]
 
-        for model in models_to_test:
+        for model, tests in selected:
             for test in model.tests:
-                test_case = TestCase(model=model, column=None, test=test)
-                test_cases.append(test_case)
+                if tests is None or test.name in tests:
+                    yield TestCase(model=model, column=None, test=test)
             for column in model.columns:
                 for test in column.tests:
-                    test_case = TestCase(model, column, test)
-                    test_cases.append(test_case)
-        return test_cases
+                    if tests is None or test.name in tests:
+                        yield TestCase(model, column, test)
 
-    def run(self, models: Sequence[str] | None = None):
-        tested = 0
-        passed = 0
-        failed = 0
-        errors = 0
+    def gather_test_cases(self, models: Sequence[str] | None = None) -> list[TestCase]:
+        """The test cases to run, from the models matching the `models` selectors.
 
-        test_cases = self.gather_test_cases(models)
+        With a shard, test cases outside of it are dropped as they're generated
+        rather than after the whole suite has been built.
+        """
+        test_cases = self.iter_test_cases(models)
+        if self.shard is not None:
+            test_cases = scheduling.shard(test_cases, *self.shard, self.shard_durations)
+        return list(test_cases)
 
-        for test_case in test_cases:
-            self.run_test(test_case)
+    def combine(self, test_case: TestCase):
+        """Records the result of a partitioned test case from those of its slices"""
+        parts = self._slices[id(test_case)]
+        test_case.has_been_run = all(x.has_been_run for x in parts)
+        test_case.timed_out = any(x.timed_out for x in parts)
+        errors = [x.error for x in parts if x.error is not None]
+        test_case.error = errors[0] if errors else None
+        test_case.passed = all(x.passed for x in parts)
+        failures = [x.failures for x in parts]
+        test_case.failures = None if None in failures else sum(failures)
+        test_case.cached = all(x.cached for x in parts)
+        test_case.enforced = all(x.enforced for x in parts)
+
+        started = [x.timings.started_at for x in parts if x.timings.started_at]
+        timings = test_case.timings
+        timings.started_at = min(started, default=None)
+        timings.connect_time = sum(x.timings.connect_time for x in parts)
+        timings.execute_time = sum(x.timings.execute_time for x in parts)
+        timings.fetch_time = sum(x.timings.fetch_time for x in parts)
+
+    def completed(self, batch: Batch) -> Iterator[TestCase]:
+        """The test cases a finished batch completes: its own, and partitioned test
+        cases once the last of their slices has run"""
+        for test_case in batch.members:
+            parent = test_case.slice_of
+            if parent is None:
+                yield test_case
+                continue
+
+            remaining = self._remaining.get(id(parent), len(self._slices[id(parent)]))
+            self._remaining[id(parent)] = remaining - 1
+            if remaining > 1:
+                continue
+
+            self.combine(parent)
+            yield parent
+            for duplicate in self._duplicates.get(id(parent), []):
+                duplicate.share(parent)
+                yield duplicate
+
+    def execute(self, test_cases: list[TestCase]) -> Iterator[TestCase]:
+        """Runs the test cases, yielding each one as soon as it has finished.
+
+        With more than one thread, batches of test cases are run concurrently on a
+        pool of workers sharing the runner's engine and are yielded in completion
+        order. At most `max_per_model` batches run against any one model at a time.
+        """
+        batches = self.queue(test_cases)
+
+        if self.threads == 1:
+            for batch in batches:
+                self.run_batch(batch)
+                yield from self.completed(batch)
+            return
+
+        dispatcher = scheduling.Dispatcher(batches, self.max_per_model)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            while dispatcher or running:
+                while len(running) < self.threads:
+                    batch = dispatcher.next()
+                    if batch is None:
+                        break
+                    running[executor.submit(self.run_batch, batch)] = batch
 
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch = running.pop(future)
+                    dispatcher.done(batch)
+                    future.result()
+                    yield from self.completed(batch)
+
+    def run(self, models: Sequence[str] | None = None) -> RunResult:
+        result = RunResult()
+        start = time.perf_counter()
+
+        test_cases = self.gather_test_cases(models)
+
+        test_run = self.execute(test_cases)
+        for test_case in test_run:
             print(test_case.report())
+            result.add(test_case)
+            test_case.release()
+            if self.should_stop(result):
+                # stops queueing batches and waits for those already running
+                test_run.close()
+                break
+
+        result.elapsed = time.perf_counter() - start
+        self.finish(test_cases, result)
+        return result
+
+    def finish(self, test_cases: list[TestCase], result: RunResult):
+        """Stores failing rows, saves the state kept between runs, writes reports and
+        prints the run summary"""
+        if self.store_failures:
+            for test_case in test_cases:
+                if test_case.status != "fail":
+                    continue
+                if test_case.duplicate_of is not None:
+                    test_case.failing_rows = test_case.duplicate_of.failing_rows
+                    continue
+                try:
+                    self.store_failing_rows(test_case)
+                except Exception as e:
+                    print(f"Couldn't store failing rows for {test_case.name}: {e}")
+
+        self.save_watermarks(test_cases)
+        self.save_state(test_cases)
+        self.save_history(test_cases)
+
+        if self.report_json:
+            shard = None
+            if self.shard is not None:
+                index, count = self.shard
+                durations = self.shard_durations
+                digest = scheduling.digest(durations) if durations else None
+                shard = {"index": index, "count": count, "durations": digest}
+            reports.write_json(self.report_json, test_cases, result, shard)
+        if self.junit:
+            reports.write_junit(self.junit, test_cases, result)
 
-            if test_case.has_been_run:
-                tested += 1
-                if test_case.error:
-                    errors += 1
-                elif test_case.passed:
-                    passed += 1
-                else:
-                    failed += 1
+        if self._cache is not None:
+            settings = self.config.cache
+            self._cache.evict(settings.max_age, settings.max_entries)
 
         separator = "+" * 79
         run_status = "Passed" if all(x.passed for x in test_cases) else "Failed"
-        run_stats = f"Tested: {tested:,} - Passed: {passed:,} - Failed: {failed:,} - Errors: {errors:,}"
+        run_stats = (
+            f"Tested: {result.tested:,} - Passed: {result.passed:,} - "
+            f"Failed: {result.failed:,} - Errors: {result.errors:,}"
+        )
+        if result.timeouts:
+            run_stats += f" - Timeouts: {result.timeouts:,}"
+        if result.enforced:
+            run_stats += f" - Enforced by constraints: {result.enforced:,}"
+        not_run = sum(not x.has_been_run for x in test_cases)
+        if not_run:
+            run_stats += f" - Not run: {not_run:,}"
         color = Colors.OKCYAN if run_status == "Passed" else Colors.FAIL
 
         print(separator)
         print(f"{color}{run_status}{Colors.ENDC}")
         print(run_stats)
+        print(f"Finished in {result.elapsed:,.2f}s")
+
+        if self.slowest:
+            print(reports.slowest(test_cases, self.slowest))
 
     def check_source(self):
         """Tests whether the data source connection is working"""
         with self.engine.connect() as db:
             pass
+
+
+# async drivers used in place of each dialect's default driver
+ASYNC_DRIVERS = {
+    "oracle": "oracledb_async",
+    "sqlite": "aiosqlite",
+    "postgresql": "asyncpg",
+    "mysql": "aiomysql",
+}
+
+
+class AsyncTestRunner(TestRunner):
+    """Runs tests on an asyncio event loop with SQLAlchemy's async engine.
+
+    Up to `concurrency` queries are kept in flight at once on a single thread, which
+    suits suites made of many small, I/O-bound queries better than a thread per
+    query. Work with no async equivalent, such as fingerprinting tables for the
+    result cache, runs on the default thread pool.
+    """
+
+    def __init__(self, config: Config, concurrency: int | None = None, **kwargs):
+        super().__init__(config, **kwargs)
+        self.concurrency = max(concurrency or config.concurrency, 1)
+        self._async_engine = None
+        self._semaphore = None
+        self._model_semaphores = {}
+
+    @property
+    def async_engine(self) -> "AsyncEngine":
+        if self._async_engine is None:
+            from sqlalchemy.ext.asyncio import create_async_engine
+
+            url = sa.make_url(self.url)
+            driver = ASYNC_DRIVERS.get(url.get_backend_name())
+            if driver and not url.get_dialect().is_async:
+                url = url.set(drivername=f"{url.get_backend_name()}+{driver}")
+            kwargs = self.engine_kwargs(url, pool_size=self.concurrency, max_overflow=0)
+            self._async_engine = create_async_engine(url, **kwargs)
+            self.configure(self._async_engine.sync_engine)
+        return self._async_engine
+
+    async def fetch_row_async(
+        self, query: test_funcs.Query, timings: Timings, timeout: float | None = None
+    ) -> Any:
+        """Runs a query on the async engine and returns its first row, timing each
+        step.
+
+        Oracle cancels queries that run past `timeout` through the driver's call
+        timeout; for other databases the query is cancelled by the event loop.
+        """
+        timings.started_at = time.time()
+        start = time.perf_counter()
+        async with self.async_engine.connect() as db:
+            connected = time.perf_counter()
+            timings.connect_time = connected - start
+
+            driver_timeout = timeout is not None and db.dialect.name == "oracle"
+            if driver_timeout:
+                raw_connection = await db.get_raw_connection()
+                previous = raw_connection.driver_connection.call_timeout
+                raw_connection.driver_connection.call_timeout = max(
+                    int(timeout * 1000), 1
+                )
+            try:
+                async with asyncio.timeout(None if driver_timeout else timeout):
+                    result = await db.execute(
+                        statement(query.sql, query.params), query.params
+                    )
+            finally:
+                executed = time.perf_counter()
+                timings.execute_time = executed - connected
+                if driver_timeout:
+                    raw_connection.driver_connection.call_timeout = previous
+            row = result.fetchone()
+            timings.fetch_time = time.perf_counter() - executed
+        return row
+
+    async def run_test_async(self, test_case: TestCase):
+        async with self._semaphore:
+            timeout = self.timeout(test_case)
+            if timeout is not None and timeout <= 0:
+                self.expire(test_case)
+                return
+
+            estimate_timings = None
+            approx_query = self.approx_query(test_case)
+            if approx_query is not None:
+                estimate_timings = replace(test_case.timings)
+                try:
+                    row = await self.fetch_row_async(
+                        approx_query, estimate_timings, timeout
+                    )
+                except Exception:
+                    row = None
+                if self.record_approximate(test_case, row, estimate_timings):
+                    return
+                timeout = self.timeout(test_case)
+
+            try:
+                query = self.compile(test_case)
+                row = await self.fetch_row_async(query, test_case.timings, timeout)
+            except Exception as e:
+                self.record(test_case, error=e)
+            else:
+                self.record(test_case, row)
+                if self.needs_count(test_case):
+                    await self.count_async(test_case)
+            self.add_estimate_timings(test_case, estimate_timings)
+
+    async def count_async(self, test_case: TestCase):
+        timeout = self.timeout(test_case)
+        if timeout is not None and timeout <= 0:
+            return
+        timings = Timings()
+        query = self.compile(test_case, probe=False)
+        try:
+            row = await self.fetch_row_async(query, timings, timeout)
+        except Exception:
+            return
+        self.record_count(test_case, row, timings)
+
+    async def run_tests_async(self, test_cases: list[TestCase]):
+        for test_case in test_cases:
+            await self.run_test_async(test_case)
+
+    async def run_fused_async(self, test_cases: list[TestCase]):
+        async with self._semaphore:
+            timeout = self.fused_timeout(test_cases)
+            if timeout is not None and timeout <= 0:
+                for test_case in test_cases:
+                    self.expire(test_case)
+                return
+
+            timings = replace(test_cases[0].timings)
+            try:
+                query = self.fused_query(test_cases)
+                row = await self.fetch_row_async(query, timings, timeout)
+            except Exception:
+                row = None
+
+        if row is None:
+            await self.run_tests_async(test_cases)
+        else:
+            self.record_fused(test_cases, row, timings)
+
+    async def run_batch_async(self, batch: Batch) -> Batch:
+        if not self.max_per_model:
+            return await self._run_batch_async(batch)
+
+        key = scheduling.model_key(batch)
+        if key not in self._model_semaphores:
+            self._model_semaphores[key] = asyncio.Semaphore(self.max_per_model)
+        async with self._model_semaphores[key]:
+            return await self._run_batch_async(batch)
+
+    async def _run_batch_async(self, batch: Batch) -> Batch:
+        pending = await asyncio.to_thread(self.prepare, batch)
+        if pending:
+            run = getattr(self, f"run_{batch.kind}_async", None)
+            if run is not None:
+                await run(pending)
+            else:
+                sync_run = getattr(self, f"run_{batch.kind}")
+                await asyncio.to_thread(sync_run, pending)
+        await asyncio.to_thread(self.store, pending)
+        self.share(batch)
+        return batch
+
+    async def execute_async(
+        self, test_cases: list[TestCase]
+    ) -> AsyncIterator[TestCase]:
+        """Runs the test cases, yielding each one as soon as it has finished"""
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = [
+            asyncio.create_task(self.run_batch_async(batch))
+            for batch in self.queue(test_cases)
+        ]
+        try:
+            for next_batch in asyncio.as_completed(tasks):
+                batch = await next_batch
+                for test_case in self.completed(batch):
+                    yield test_case
+        finally:
+            # cancels the rest of the run when stopped early
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if self._async_engine is not None:
+                await self._async_engine.dispose()
+                self._async_engine = None
+
+    async def run_async(self, models: Sequence[str] | None = None) -> RunResult:
+        result = RunResult()
+        start = time.perf_counter()
+
+        test_cases = self.gather_test_cases(models)
+
+        async with aclosing(self.execute_async(test_cases)) as test_run:
+            async for test_case in test_run:
+                print(test_case.report())
+                result.add(test_case)
+                test_case.release()
+                if self.should_stop(result):
+                    break
+
+        result.elapsed = time.perf_counter() - start
+        self.finish(test_cases, result)
+        return result
+
+    def run(self, models: Sequence[str] | None = None) -> RunResult:
+        return asyncio.run(self.run_async(models))
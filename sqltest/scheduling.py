@@ -0,0 +1,125 @@
+from collections import Counter, deque
+import hashlib
+import heapq
+import json
+from typing import TYPE_CHECKING, Iterable
+
+if TYPE_CHECKING:
+    from sqltest.runner import Batch, TestCase
+
+
+def model_key(batch: "Batch") -> int:
+    """Identifies the model a batch of test cases runs against"""
+    return id(batch.test_cases[0].model)
+
+
+def estimate(batch: "Batch", durations: dict[str, float], default: float) -> float:
+    """Expected seconds to run a batch, from its test cases' past durations.
+
+    Test cases in a batch that run a single shared query (e.g. a fused scan) each
+    record the query's duration, so only the longest counts towards the estimate.
+    """
+    estimates = [durations.get(x.id, default) for x in batch.test_cases]
+    if batch.kind == "tests":
+        return sum(estimates)
+    return max(estimates)
+
+
+def longest_first(batches: list["Batch"], durations: dict[str, float]) -> list["Batch"]:
+    """Orders batches so that those expected to take longest start first.
+
+    Starting the long tests early keeps a long test from running alone at the end of
+    a concurrent run. Batches without any history are expected to take the average
+    duration, and ties keep their original order.
+    """
+    default = sum(durations.values()) / len(durations) if durations else 0.0
+    return sorted(batches, key=lambda x: -estimate(x, durations, default))
+
+
+def stable_hash(value: str) -> int:
+    """A hash of a string that, unlike `hash`, is the same in every process"""
+    return int.from_bytes(hashlib.sha1(value.encode()).digest()[:8], "big")
+
+
+def digest(durations: dict[str, float]) -> str:
+    """A short hash of a set of durations, to check that shards were split alike"""
+    payload = json.dumps(durations, sort_keys=True)
+    return hashlib.sha1(payload.encode()).hexdigest()[:12]
+
+
+def shard(
+    test_cases: Iterable["TestCase"],
+    index: int,
+    count: int,
+    durations: dict[str, float] | None = None,
+) -> list["TestCase"]:
+    """The test cases in shard `index` (counting from 1) of `count`.
+
+    Test cases are assigned to shards by a stable hash of their ids, so every
+    process computes the same split. Given the durations of previous runs, test
+    cases are instead dealt out longest first to the shard with the least work so
+    far, which balances the shards' run times as long as every process is given the
+    same durations.
+    """
+    if not durations:
+        return [x for x in test_cases if stable_hash(x.id) % count == index - 1]
+
+    test_cases = list(test_cases)
+    default = sum(durations.values()) / len(durations)
+    ranked = sorted(test_cases, key=lambda x: (-durations.get(x.id, default), x.id))
+    loads = [(0.0, i) for i in range(count)]
+    chosen = set()
+    for test_case in ranked:
+        load, i = heapq.heappop(loads)
+        if i == index - 1:
+            chosen.add(test_case.id)
+        heapq.heappush(loads, (load + durations.get(test_case.id, default), i))
+    return [x for x in test_cases if x.id in chosen]
+
+
+def failed_first(batches: list["Batch"], failing: set[str]) -> list["Batch"]:
+    """Moves batches holding a test that failed last time to the front, keeping the
+    order of batches otherwise"""
+    return sorted(batches, key=lambda x: all(y.id not in failing for y in x.test_cases))
+
+
+class Dispatcher:
+    """Hands out batches in order, holding back batches on models that already have
+    `max_per_model` batches running so that no one table gets all the workers"""
+
+    def __init__(self, batches: list["Batch"], max_per_model: int | None = None):
+        self.max_per_model = max_per_model
+        self.running = Counter()
+        self.queues: dict[int, deque] = {}
+        for rank, batch in enumerate(batches):
+            self.queues.setdefault(model_key(batch), deque()).append((rank, batch))
+        self.heap = [(queue[0][0], key) for key, queue in self.queues.items()]
+        heapq.heapify(self.heap)
+
+    def __bool__(self) -> bool:
+        return bool(self.heap)
+
+    def next(self) -> "Batch | None":
+        """The next batch that can be started, if any"""
+        held = []
+        batch = None
+        while self.heap:
+            rank, key = heapq.heappop(self.heap)
+            if self.max_per_model and self.running[key] >= self.max_per_model:
+                held.append((rank, key))
+                continue
+
+            queue = self.queues[key]
+            _, batch = queue.popleft()
+            if queue:
+                heapq.heappush(self.heap, (queue[0][0], key))
+            self.running[key] += 1
+            break
+
+        for item in held:
+            heapq.heappush(self.heap, item)
+        return batch
+
+    def done(self, batch: "Batch"):
+        """Marks a batch handed out by `next` as finished"""
+        self.running[model_key(batch)] -= 1
@@ -0,0 +1,103 @@
+from collections import defaultdict
+from typing import TYPE_CHECKING, Sequence
+
+if TYPE_CHECKING:
+    from sqltest.models import Manifest, Model
+
+# selector methods, e.g. `schema:findw`; other selectors name a model, optionally
+# prefixed with `+` to add the models it has relationships with
+METHODS = ("schema", "tag", "test", "state")
+
+
+class Registry:
+    """Indexes a project's models by name, schema, tag and test, and by the
+    `relationships` tests between them, so that selecting models doesn't scan them
+    all for each selector"""
+
+    def __init__(self, models: list["Model"], manifest: "Manifest | None" = None):
+        self.models = models
+        self.manifest = manifest
+        self.by_name: dict[str, list[Model]] = defaultdict(list)
+        self.by_schema: dict[str, list[Model]] = defaultdict(list)
+        self.by_tag: dict[str, list[Model]] = defaultdict(list)
+        self.by_test: dict[str, list[Model]] = defaultdict(list)
+        # the models each model's relationships tests point at, and the reverse
+        self.parents: dict[int, list[Model]] = defaultdict(list)
+        self.children: dict[int, list[Model]] = defaultdict(list)
+
+        targets = []
+        for model in models:
+            self.by_name[model.name.lower()].append(model)
+            self.by_name[f"{model.schema}.{model.name}".lower()].append(model)
+            self.by_schema[model.schema.lower()].append(model)
+            for tag in model.tags:
+                self.by_tag[tag.lower()].append(model)
+            tests = [*model.tests, *(x for c in model.columns for x in c.tests)]
+            for name in {x.name for x in tests}:
+                self.by_test[name].append(model)
+            targets += [(model, x.kwargs["to"]) for x in tests if "to" in x.kwargs]
+
+        for model, to in targets:
+            for parent in self.by_name.get(to.lower(), []):
+                if parent is not model:
+                    self.parents[id(model)].append(parent)
+                    self.children[id(parent)].append(model)
+
+    def get(self, name: str) -> "Model":
+        """The model named `name`, optionally qualified with its schema"""
+        models = self.by_name.get(name.lower())
+        if not models:
+            raise ValueError(f'Could not find a model matching "{name}"')
+        return models[0]
+
+    def match(self, selector: str, state: "Manifest | None" = None) -> list["Model"]:
+        """The models matching a single selector"""
+        method, _, value = selector.rpartition(":")
+        if method and method not in METHODS:
+            raise ValueError(f'Unknown selector "{selector}"')
+
+        match method:
+            case "schema":
+                return self.by_schema.get(value.lower(), [])
+            case "tag":
+                return self.by_tag.get(value.lower(), [])
+            case "test":
+                return self.by_test.get(value, [])
+            case "state":
+                if value != "modified":
+                    raise ValueError(f'Unknown selector "{selector}"')
+                if state is None:
+                    raise ValueError(f"{selector} needs a saved state to compare with")
+                if self.manifest is None:
+                    return []
+                return self.manifest.modified(state)
+
+        if value.startswith("+"):
+            models = self.by_name.get(value[1:].lower(), [])
+            related = [
+                x
+                for model in models
+                for x in (*self.parents[id(model)], *self.children[id(model)])
+            ]
+            return [*models, *related]
+        return self.by_name.get(value.lower(), [])
+
+    def select(
+        self, selectors: Sequence[str], state: "Manifest | None" = None
+    ) -> list[tuple["Model", set[str] | None]]:
+        """The models matching any of `selectors`, in the order they were defined.
+
+        Each model comes with the names of the tests selected on it, or None for all
+        of them: `test:` selectors pick out tests rather than whole models.
+        `state:modified` selects models whose files are new or have changed since
+        the `state` manifest was saved.
+        """
+        selected: dict[int, set[str] | None] = {}
+        for selector in selectors:
+            method, _, value = selector.rpartition(":")
+            for model in self.match(selector, state):
+                if method != "test":
+                    selected[id(model)] = None
+                elif selected.get(id(model), set()) is not None:
+                    selected.setdefault(id(model), set()).add(value)
+        return [(x, selected[id(x)]) for x in self.models if id(x) in selected]
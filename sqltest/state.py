@@ -0,0 +1,102 @@
+from datetime import date, datetime
+from decimal import Decimal
+import json
+from pathlib import Path
+import threading
+from typing import Any
+
+
+def encode_value(value: Any) -> dict:
+    """Encodes a database value as json, keeping enough of its type to bind it as a
+    parameter again"""
+    if isinstance(value, datetime):
+        return {"type": "datetime", "value": value.isoformat()}
+    if isinstance(value, date):
+        return {"type": "date", "value": value.isoformat()}
+    if isinstance(value, Decimal):
+        return {"type": "decimal", "value": str(value)}
+    return {"type": "json", "value": value}
+
+
+def decode_value(obj: dict) -> Any:
+    """Decodes a value encoded with `encode_value`"""
+    match obj["type"]:
+        case "datetime":
+            return datetime.fromisoformat(obj["value"])
+        case "date":
+            return date.fromisoformat(obj["value"])
+        case "decimal":
+            return Decimal(obj["value"])
+        case _:
+            return obj["value"]
+
+
+class JsonStore:
+    """A json file in the target directory holding state kept between runs"""
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._data = None
+
+    @property
+    def data(self) -> dict:
+        if self._data is None:
+            if self.path.exists():
+                self._data = json.loads(self.path.read_text())
+            else:
+                self._data = {}
+        return self._data
+
+    def save(self):
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.path.write_text(json.dumps(self.data, indent=2, sort_keys=True))
+
+
+class Watermarks(JsonStore):
+    """The highest value of each incremental model's watermark column that has been
+    tested successfully"""
+
+    @staticmethod
+    def key(schema: str, name: str, column: str) -> str:
+        return f"{schema}.{name}.{column}".lower()
+
+    def get(self, schema: str, name: str, column: str) -> Any:
+        value = self.data.get(self.key(schema, name, column))
+        return None if value is None else decode_value(value)
+
+    def set(self, schema: str, name: str, column: str, value: Any):
+        with self._lock:
+            self.data[self.key(schema, name, column)] = encode_value(value)
+
+
+class History(JsonStore):
+    """How long each test has taken in recent runs and how it last ended, by test
+    id"""
+
+    # weight given to the latest duration in the moving average
+    smoothing = 0.5
+
+    @property
+    def durations(self) -> dict[str, float]:
+        return {k: v["duration"] for k, v in self.data.items() if "duration" in v}
+
+    @property
+    def failing(self) -> set[str]:
+        """Tests that didn't pass the last time they were run"""
+        unsuccessful = {"fail", "error", "timeout"}
+        return {k for k, v in self.data.items() if v.get("status") in unsuccessful}
+
+    def record(self, test_id: str, status: str, duration: float | None = None):
+        with self._lock:
+            entry = self.data.setdefault(test_id, {})
+            entry["status"] = status
+            if duration is None:
+                return
+            if "duration" not in entry:
+                entry["duration"] = duration
+                entry["runs"] = 1
+                return
+            entry["duration"] += self.smoothing * (duration - entry["duration"])
+            entry["runs"] += 1
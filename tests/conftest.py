@@ -1,6 +1,8 @@
+import sqlite3
+
 import pytest
 
-from sqltest.models import Model
+from sqltest.models import Config, Model
 
 
 @pytest.fixture
@@ -17,3 +19,42 @@ def model():
         ],
     }
     return Model.from_obj(model_config)
+
+
+@pytest.fixture
+def sqlite_config(tmp_path):
+    """A config pointing at a small sqlite database with a `people` table"""
+    db_path = tmp_path / "test.db"
+    with sqlite3.connect(db_path) as db:
+        db.execute("create table people (id integer, name text, status text)")
+        db.executemany(
+            "insert into people values (?, ?, ?)",
+            [(1, "ann", "A"), (2, "bob", "I"), (3, None, "A"), (3, "cat", "X")],
+        )
+
+    obj = {
+        "source": {"name": "test", "url": f"sqlite:///{db_path}"},
+        "target_dir": str(tmp_path / ".sqltest"),
+        "models": [
+            {
+                "name": "people",
+                "schema": "main",
+                "columns": [
+                    {"name": "id", "tests": ["unique", "not_null"]},
+                    {"name": "name", "tests": ["not_null", "at_least_one"]},
+                    {
+                        "name": "status",
+                        "tests": [
+                            {"accepted_values": {"values": ["A", "I"]}},
+                            {
+                                "expression_is_true": {
+                                    "expression": "length(status) = 1"
+                                }
+                            },
+                        ],
+                    },
+                ],
+            }
+        ],
+    }
+    return Config.from_obj(obj)
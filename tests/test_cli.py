@@ -0,0 +1,100 @@
+import json
+from pathlib import Path
+import subprocess
+import sys
+
+from click.testing import CliRunner
+
+from sqltest import runner
+from sqltest.cli import cli
+
+# dependencies that shouldn't be imported until a command needs them
+HEAVY_MODULES = ["sqlalchemy", "oracledb", "yaml", "dotenv", "sqltest.runner"]
+
+
+def test_cli_import_is_lightweight():
+    code = (
+        "import sys, sqltest.cli;"
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=Path(__file__).parents[1],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert output.stdout.strip() == ""
+
+
+def test_cli_help_without_config(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    result = CliRunner().invoke(cli, ["--help"])
+    assert result.exit_code == 0
+
+
+def test_cli_test_without_config(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    result = CliRunner().invoke(cli, ["test"])
+    assert result.exit_code == 2
+    assert "Could not find a config file" in result.output
+
+
+def test_cli_test_missing_state(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    result = CliRunner().invoke(cli, ["test", "--state", "missing.pickle"])
+    assert result.exit_code == 2
+    assert "does not exist" in result.output
+
+
+def test_cli_merge_results(sqlite_config, tmp_path):
+    reports = []
+    for i in (1, 2):
+        report = tmp_path / f"shard{i}.json"
+        runner.TestRunner(sqlite_config, shard=(i, 2), report_json=report).run()
+        reports.append(str(report))
+
+    merged = tmp_path / "merged.json"
+    result = CliRunner().invoke(cli, ["merge-results", *reports, "-o", merged])
+
+    assert result.exit_code == 1
+    assert "Tested: 6 - Passed: 3 - Failed: 3" in result.output
+    assert len(json.loads(merged.read_text())["results"]) == 6
+
+
+def test_cli_merge_results_checks_shard_durations(sqlite_config, tmp_path):
+    reports = []
+    for i in (1, 2):
+        report = tmp_path / f"shard{i}.json"
+        runner.TestRunner(sqlite_config, shard=(i, 2), report_json=report).run()
+        reports.append(str(report))
+    durations = tmp_path / "durations.json"
+    result = CliRunner().invoke(
+        cli, ["merge-results", *reports, "--durations", durations]
+    )
+    assert len(json.loads(durations.read_text())) == 6
+
+    # one worker balanced with the durations and the other didn't
+    balanced = tmp_path / "balanced.json"
+    runner.TestRunner(
+        sqlite_config, shard=(2, 2), shard_durations=durations, report_json=balanced
+    ).run()
+    result = CliRunner().invoke(cli, ["merge-results", reports[0], str(balanced)])
+
+    assert result.exit_code == 1
+    assert "split differently" in result.output
+
+
+def test_cli_merge_results_checks_shards_are_complete(sqlite_config, tmp_path):
+    reports = []
+    for i in (1, 2, 3):
+        report = tmp_path / f"shard{i}.json"
+        runner.TestRunner(sqlite_config, shard=(i, 3), report_json=report).run()
+        reports.append(str(report))
+    unsharded = tmp_path / "unsharded.json"
+    runner.TestRunner(sqlite_config, report_json=unsharded).run()
+
+    for given in [reports[:2], [*reports, reports[0]], [*reports[1:], str(unsharded)]]:
+        result = CliRunner().invoke(cli, ["merge-results", *given])
+        assert result.exit_code == 1
+        assert "Expected a report from each of shards 1 to 3" in result.output
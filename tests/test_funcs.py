@@ -2,11 +2,12 @@ from textwrap import dedent
 
 import pytest
 from sqltest import funcs
+from sqltest.models import ModelTest
 
 
 def test_func_unique(model):
     column = model.columns[0]
-    actual_sql = funcs.unique(model, column)
+    actual_sql = funcs.unique(model, column).sql
     expected_sql = dedent(
         """\
         select
@@ -28,5 +29,67 @@ def test_func_unique(model):
 def test_func_accepted_range_with_min_max(model):
     column = model.columns[1]
     test = column.tests[0]
-    actual_sql = funcs.accepted_range(model, column, **test.kwargs)
-    assert "bar < 1 or bar > 10" in actual_sql
+    query = funcs.accepted_range(model, column, **test.kwargs)
+    assert "bar < :p0 or bar > :p1" in query.sql
+    assert query.params == {"p0": 1, "p1": 10}
+
+
+def test_func_fused(model):
+    column = model.columns[0]
+    tests = [
+        (column, ModelTest("not_null")),
+        (None, ModelTest("expression_is_true", {"expression": "foo > 0"})),
+    ]
+    actual_sql = funcs.fused(model, tests).sql
+    expected_sql = dedent(
+        """\
+        select
+          sum(case when (foo is null) then 1 else 0 end) as failures_0,
+          sum(case when (not(foo > 0)) then 1 else 0 end) as failures_1
+        from dev.test_model"""
+    )
+    assert actual_sql == expected_sql
+
+
+def test_func_accepted_values_binds_values(model):
+    column = model.columns[0]
+    query = funcs.accepted_values(model, column, values=["a", "it's"])
+    assert "foo not in (:p0, :p1)" in query.sql
+    assert query.params == {"p0": "a", "p1": "it's"}
+
+
+def test_func_fused_binds_unique_params(model):
+    column = model.columns[0]
+    tests = [
+        (column, ModelTest("accepted_values", {"values": ["a"]})),
+        (column, ModelTest("bit")),
+    ]
+    query = funcs.fused(model, tests)
+    assert query.params == {"p0": "a", "p1": "Y", "p2": "N"}
+
+
+def test_func_probe_fetch_first(model):
+    column = model.columns[0]
+    query = funcs.probe(funcs.not_null(model, column), "oracle")
+    expected_sql = dedent(
+        """\
+        select
+          count(*) as failures
+        from (
+
+          select foo
+          from dev.test_model
+          where
+            foo is null
+          fetch first 1 rows only
+
+        )"""
+    )
+    assert query.sql == expected_sql
+
+
+def test_func_probe_exists(model):
+    column = model.columns[0]
+    query = funcs.probe(funcs.unique(model, column), "sqlite")
+    assert query.sql.startswith("select\n  case when exists (")
+    assert query.sql.endswith(") then 1 else 0 end as failures")
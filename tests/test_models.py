@@ -1,4 +1,5 @@
 import pytest
+from sqltest import models
 from sqltest.models import ModelTest, ModelColumn, Model, Config
 
 
@@ -18,6 +19,14 @@ def test_model_test_from_obj():
     assert model.kwargs == {"expression": "foo = bar"}
 
 
+def test_model_test_from_obj_with_settings():
+    obj = {"unique": {"mode": "probe"}}
+    model = ModelTest.from_obj(obj)
+
+    assert model.mode == "probe"
+    assert model.kwargs == {}
+
+
 def test_model_column_from_obj():
     obj = {
         "name": "column_a",
@@ -60,3 +69,30 @@ def test_config_from_obj():
     config = Config.from_obj(obj)
     assert len(config.models) == 2
     assert config.models[0].name == "model_a"
+
+
+def test_config_from_obj_reuses_manifest(tmp_path, monkeypatch):
+    models_dir = tmp_path / "models"
+    models_dir.mkdir()
+    for name in ("model_a", "model_b"):
+        (models_dir / f"{name}.yml").write_text(f"name: {name}\nschema: dev\n")
+    obj = {
+        "source": {"name": "foo", "url": "foodriver://foo.com:1234"},
+        "models_dir": str(models_dir),
+        "target_dir": str(tmp_path / ".sqltest"),
+    }
+    config = Config.from_obj(obj)
+    assert sorted(x.name for x in config.models) == ["model_a", "model_b"]
+
+    parsed = []
+    load_yaml = models.load_yaml
+    monkeypatch.setattr(models, "load_yaml", lambda x: parsed.append(x) or load_yaml(x))
+
+    config = Config.from_obj(obj)
+    assert len(config.models) == 2
+    assert parsed == []
+
+    (models_dir / "model_b.yml").write_text("name: model_c\nschema: prod\n")
+    config = Config.from_obj(obj)
+    assert sorted(x.name for x in config.models) == ["model_a", "model_c"]
+    assert len(parsed) == 1
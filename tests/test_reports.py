@@ -0,0 +1,61 @@
+import json
+import xml.etree.ElementTree as ET
+
+from sqltest import funcs, runner
+
+
+def test_run_writes_reports(sqlite_config, tmp_path):
+    report_json = tmp_path / "results.json"
+    junit = tmp_path / "results.xml"
+    test_runner = runner.TestRunner(
+        sqlite_config, report_json=report_json, junit=junit, slowest=3
+    )
+    test_runner.run()
+
+    report = json.loads(report_json.read_text())
+    assert report["summary"] == {
+        "tested": 6,
+        "passed": 3,
+        "failed": 3,
+        "errors": 0,
+        "timeouts": 0,
+        "enforced": 0,
+    }
+    first = report["results"][0]
+    assert first["name"] == "main.people.id: unique"
+    assert first["status"] == "fail"
+    assert first["failures"] == 1
+    assert first["started_at"] >= first["queued_at"]
+    assert first["duration"] > 0
+
+    suite = ET.parse(junit).getroot()
+    assert suite.get("tests") == "6"
+    assert suite.get("failures") == "3"
+    assert len(suite.findall("testcase/failure")) == 3
+
+
+def test_fused_tests_share_timings(sqlite_config):
+    test_runner = runner.TestRunner(sqlite_config, fuse=True)
+    test_cases = test_runner.gather_test_cases()
+    for _ in test_runner.execute(test_cases):
+        pass
+
+    fused = [x for x in test_cases if funcs.is_fusable(x.test.name)]
+    assert len(fused) == 4
+    assert len({x.timings.started_at for x in fused}) == 1
+
+
+def test_run_stores_failing_rows(sqlite_config, tmp_path):
+    store = tmp_path / "failures"
+    test_runner = runner.TestRunner(
+        sqlite_config, store_failures=store, store_failures_limit=1, arraysize=1
+    )
+    test_runner.run()
+
+    files = sorted(store.iterdir())
+    assert len(files) == 3
+
+    [unique] = [x for x in files if ".id.unique." in x.name]
+    lines = unique.read_text().splitlines()
+    assert len(lines) == 2
+    assert lines[1].split(",")[0] == "3"
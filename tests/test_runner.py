@@ -0,0 +1,708 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import sqlite3
+import time
+
+import pytest
+import sqlalchemy as sa
+
+from sqltest import funcs, materialize, partitions, runner
+from sqltest.models import Model, ModelTest, PartitionBy
+
+
+def test_runner_run(sqlite_config):
+    result = runner.TestRunner(sqlite_config).run()
+
+    assert result.tested == 6
+    assert result.passed == 3
+    assert result.failed == 3
+    assert result.errors == 0
+
+
+def test_runner_run_threaded_matches_serial(sqlite_config):
+    serial = runner.TestRunner(sqlite_config).run()
+    threaded = runner.TestRunner(sqlite_config, threads=4).run()
+
+    assert threaded == serial
+
+
+@pytest.mark.parametrize("name", ["engine", "cache", "history", "watermarks"])
+def test_runner_creates_shared_objects_once(sqlite_config, monkeypatch, name):
+    create_engine = sa.create_engine
+
+    def slow_create_engine(*args, **kwargs):
+        time.sleep(0.05)
+        return create_engine(*args, **kwargs)
+
+    monkeypatch.setattr(sa, "create_engine", slow_create_engine)
+    for cls_name in ("ResultCache", "History", "Watermarks"):
+        cls = getattr(runner, cls_name)
+        monkeypatch.setattr(
+            runner, cls_name, lambda *args, cls=cls: time.sleep(0.05) or cls(*args)
+        )
+
+    test_runner = runner.TestRunner(sqlite_config, threads=16)
+    with ThreadPoolExecutor(16) as executor:
+        created = list(executor.map(lambda _: getattr(test_runner, name), range(16)))
+
+    assert len({id(x) for x in created}) == 1
+
+
+def test_runner_fused_matches_unfused(sqlite_config):
+    test_runner = runner.TestRunner(sqlite_config, fuse=True)
+    batches = test_runner.plan(test_runner.gather_test_cases())
+
+    # not_null x2, accepted_values & expression_is_true share a single scan
+    assert len(batches) == 3
+    assert len(batches[0].test_cases) == 1
+    assert len(batches[1].test_cases) == 4
+
+    assert test_runner.run() == runner.TestRunner(sqlite_config).run()
+
+
+def test_runner_fused_falls_back_on_error(sqlite_config):
+    model = sqlite_config.models[0]
+    model.columns[2].tests[1].kwargs["expression"] = "no_such_column = 1"
+
+    result = runner.TestRunner(sqlite_config, fuse=True).run()
+
+    assert result.errors == 1
+    assert result.failed == 3
+
+
+@pytest.mark.parametrize("runner_cls", [runner.TestRunner, runner.AsyncTestRunner])
+def test_runner_fused_isolates_misconfigured_tests(sqlite_config, runner_cls):
+    if runner_cls is runner.AsyncTestRunner:
+        pytest.importorskip("aiosqlite")
+        pytest.importorskip("greenlet")
+
+    model = sqlite_config.models[0]
+    model.columns[0].tests.append(ModelTest("accepted_range"))
+    model.columns[1].tests.append(ModelTest("relationships", {"to": "main.people"}))
+    model.tests.append(ModelTest("relationships", {"to": "main.people", "field": "id"}))
+
+    unfused = runner_cls(sqlite_config).run()
+    fused = runner_cls(sqlite_config, fuse=True).run()
+
+    assert fused.errors == unfused.errors == 3
+    assert (fused.passed, fused.failed) == (unfused.passed, unfused.failed)
+
+
+@pytest.mark.parametrize("fuse", [False, True])
+def test_runner_colons_in_expressions(sqlite_config, fuse):
+    model = sqlite_config.models[0]
+    model.tests.append(
+        ModelTest("expression_is_true", {"expression": "'a :b' = 'a :b'"})
+    )
+    model.tests.append(
+        ModelTest("expression_is_true", {"expression": "'12:00:00' like '%:00'"})
+    )
+
+    test_cases = run_test_cases(runner.TestRunner(sqlite_config, fuse=fuse))
+
+    assert [
+        x.status for x in test_cases if ":" in x.test.kwargs.get("expression", "")
+    ] == ["pass", "pass"]
+
+
+def test_runner_probe_mode(sqlite_config):
+    sqlite_config.models[0].columns[0].tests[0].mode = "count"
+    test_runner = runner.TestRunner(sqlite_config, mode="probe", count_failures=False)
+    test_cases = test_runner.gather_test_cases()
+    for test_case in test_cases:
+        test_runner.run_test(test_case)
+
+    assert [x.passed for x in test_cases] == [False, True, False, True, False, True]
+    # probed failures aren't counted
+    assert test_cases[0].failures == 1
+    assert test_cases[1].failures == 0
+    assert test_cases[2].failures is None
+
+
+@pytest.mark.parametrize("runner_cls", [runner.TestRunner, runner.AsyncTestRunner])
+def test_runner_probe_mode_counts_failures(sqlite_config, tmp_path, runner_cls):
+    if runner_cls is runner.AsyncTestRunner:
+        pytest.importorskip("aiosqlite")
+        pytest.importorskip("greenlet")
+
+    failures = {}
+    for mode in ("count", "probe"):
+        report = tmp_path / f"{mode}.json"
+        runner_cls(sqlite_config, mode=mode, cache=False, report_json=report).run()
+        results = json.loads(report.read_text())["results"]
+        failures[mode] = [(x["status"], x["failures"]) for x in results]
+
+    assert failures["probe"] == failures["count"]
+    assert ("fail", 1) in failures["probe"]
+
+
+def run_test_cases(test_runner):
+    test_cases = test_runner.gather_test_cases()
+    for _ in test_runner.execute(test_cases):
+        pass
+    return test_cases
+
+
+def test_runner_doesnt_cache_probed_failures(sqlite_config):
+    sqlite_config.cache.fingerprint = "select count(*) from {schema}.{name}"
+    probed = run_test_cases(
+        runner.TestRunner(sqlite_config, mode="probe", count_failures=False)
+    )
+    assert probed[0].failures is None
+
+    test_cases = run_test_cases(runner.TestRunner(sqlite_config))
+    assert not test_cases[0].cached
+    assert test_cases[0].failures == 1
+    # passes are cached whatever the mode
+    assert test_cases[1].cached
+
+
+def test_runner_reuses_cached_results(sqlite_config):
+    sqlite_config.cache.fingerprint = "select count(*) from {schema}.{name}"
+
+    first = run_test_cases(runner.TestRunner(sqlite_config))
+    assert not any(x.cached for x in first)
+
+    second = run_test_cases(runner.TestRunner(sqlite_config))
+    assert all(x.cached for x in second)
+    assert [x.passed for x in second] == [x.passed for x in first]
+
+    # changing the table changes its fingerprint
+    url = sqlite_config.source.url.removeprefix("sqlite:///")
+    with sqlite3.connect(url) as db:
+        db.execute("insert into people values (4, 'dan', 'A')")
+    third = run_test_cases(runner.TestRunner(sqlite_config))
+    assert not any(x.cached for x in third)
+
+
+def test_runner_no_cache(sqlite_config):
+    sqlite_config.cache.fingerprint = "select count(*) from {schema}.{name}"
+    run_test_cases(runner.TestRunner(sqlite_config))
+
+    test_cases = run_test_cases(runner.TestRunner(sqlite_config, cache=False))
+    assert not any(x.cached for x in test_cases)
+
+
+def test_runner_incremental_tests_new_rows(sqlite_config):
+    url = sqlite_config.source.url.removeprefix("sqlite:///")
+    with sqlite3.connect(url) as db:
+        db.execute("create table events (id integer, batch integer)")
+        db.executemany("insert into events values (?, ?)", [(1, 1), (2, 1)])
+    sqlite_config.models = [
+        Model.from_obj(
+            {
+                "name": "events",
+                "schema": "main",
+                "incremental": {"column": "batch"},
+                "columns": [{"name": "id", "tests": ["not_null", "unique"]}],
+            }
+        )
+    ]
+
+    assert runner.TestRunner(sqlite_config).run().success
+    assert (
+        runner.TestRunner(sqlite_config).watermarks.get("main", "events", "batch") == 1
+    )
+
+    # rows behind the watermark aren't tested again, whole-table tests still are
+    with sqlite3.connect(url) as db:
+        db.executemany("insert into events values (?, ?)", [(None, 1), (2, 2)])
+    test_cases = run_test_cases(runner.TestRunner(sqlite_config))
+    assert [x.passed for x in test_cases] == [True, False]
+    assert test_cases[0].relation_params == {"wm_low": 1, "wm_high": 2}
+
+    test_cases = run_test_cases(runner.TestRunner(sqlite_config, full_refresh=True))
+    assert [x.passed for x in test_cases] == [False, False]
+
+    # rows with a null watermark are only tested by a full refresh
+    with sqlite3.connect(url) as db:
+        db.execute("delete from events where id is null or batch = 2")
+        db.execute("insert into events values (null, null)")
+    test_cases = run_test_cases(runner.TestRunner(sqlite_config, full_refresh=True))
+    assert [x.passed for x in test_cases] == [False, True]
+
+
+def test_runner_partial_run_keeps_watermark(sqlite_config):
+    url = sqlite_config.source.url.removeprefix("sqlite:///")
+    with sqlite3.connect(url) as db:
+        db.execute("create table events (id integer, batch integer)")
+        db.executemany("insert into events values (?, ?)", [(1, 1), (2, 2)])
+    sqlite_config.models = [
+        Model.from_obj(
+            {
+                "name": "events",
+                "schema": "main",
+                "incremental": {"column": "batch"},
+                "columns": [{"name": "id", "tests": ["not_null", "unique"]}],
+            }
+        )
+    ]
+
+    assert runner.TestRunner(sqlite_config).run(["test:unique"]).success
+    test_runner = runner.TestRunner(sqlite_config)
+    assert test_runner.watermarks.get("main", "events", "batch") is None
+
+    assert test_runner.run().success
+    assert test_runner.watermarks.get("main", "events", "batch") == 2
+
+
+def test_async_runner_matches_sync(sqlite_config):
+    pytest.importorskip("aiosqlite")
+    pytest.importorskip("greenlet")
+
+    async_runner = runner.AsyncTestRunner(sqlite_config, concurrency=3, fuse=True)
+    assert async_runner.run() == runner.TestRunner(sqlite_config).run()
+
+
+# an expression that takes sqlite several seconds to evaluate
+SLOW_EXPRESSION = (
+    "(with recursive c(x) as (select 1 union all select x + 1 from c where x < 1e8)"
+    " select count(*) from c) > 0"
+)
+
+
+def test_runner_times_out_slow_tests(sqlite_config):
+    model = sqlite_config.models[0]
+    model.tests.append(
+        ModelTest("expression_is_true", {"expression": SLOW_EXPRESSION}, timeout=0.2)
+    )
+
+    result = runner.TestRunner(sqlite_config).run()
+
+    assert result.timeouts == 1
+    assert result.errors == 0
+    assert result.tested == 7
+
+
+class DriverError(Exception):
+    def __init__(self, *args, **attrs):
+        super().__init__(*args)
+        self.__dict__.update(attrs)
+
+
+@pytest.mark.parametrize(
+    "orig, expected",
+    [
+        (sqlite3.OperationalError("interrupted"), True),
+        (sqlite3.OperationalError("no such table: people"), False),
+        (DriverError("DPY-4011: the database or network closed the connection"), True),
+        (DriverError("DPY-4024: call timeout of 200 ms exceeded"), True),
+        (DriverError("ORA-01013: user requested cancel of current operation"), True),
+        (DriverError("ORA-00942: table or view does not exist"), False),
+        (DriverError("canceling statement", sqlstate="57014"), True),
+        (DriverError("canceling statement", pgcode="57014"), True),
+        (DriverError("relation does not exist", sqlstate="42P01"), False),
+        (DriverError(3024, "maximum statement execution time exceeded"), True),
+        (DriverError(1146, "Table doesn't exist"), False),
+    ],
+)
+def test_runner_classifies_timeouts(sqlite_config, orig, expected):
+    test_case = run_test_cases(runner.TestRunner(sqlite_config))[0]
+    error = sa.exc.OperationalError("select 1", {}, orig)
+
+    runner.TestRunner(sqlite_config).record(test_case, error=error)
+
+    assert test_case.timed_out is expected
+    assert test_case.status == ("timeout" if expected else "error")
+
+
+def test_runner_time_budget(sqlite_config):
+    model = sqlite_config.models[0]
+    model.tests.append(ModelTest("expression_is_true", {"expression": SLOW_EXPRESSION}))
+
+    test_runner = runner.TestRunner(sqlite_config, time_budget=0.3)
+    test_cases = run_test_cases(test_runner)
+
+    # the slow test uses up the budget, leaving none for the tests after it
+    assert [x.status for x in test_cases] == ["timeout"] * 7
+
+
+def test_runner_records_history(sqlite_config):
+    runner.TestRunner(sqlite_config).run()
+    test_runner = runner.TestRunner(sqlite_config, order="longest", threads=2)
+    durations = test_runner.history.durations
+    test_cases = test_runner.gather_test_cases()
+
+    assert sorted(durations) == sorted(x.id for x in test_cases)
+
+    batches = test_runner.queue(test_cases)
+    estimates = [durations[x.test_cases[0].id] for x in batches]
+    assert estimates == sorted(estimates, reverse=True)
+    assert test_runner.run() == runner.TestRunner(sqlite_config).run()
+
+
+@pytest.mark.parametrize(
+    "runner_cls, kwargs",
+    [
+        (runner.TestRunner, {}),
+        (runner.TestRunner, {"threads": 2}),
+        (runner.AsyncTestRunner, {"concurrency": 1}),
+    ],
+)
+def test_runner_max_failures(sqlite_config, runner_cls, kwargs):
+    if runner_cls is runner.AsyncTestRunner:
+        pytest.importorskip("aiosqlite")
+        pytest.importorskip("greenlet")
+
+    result = runner_cls(sqlite_config, max_failures=1, **kwargs).run()
+
+    assert result.failed >= 1
+    assert result.tested < 6
+
+
+def test_runner_failed_first(sqlite_config):
+    runner.TestRunner(sqlite_config).run()
+    test_runner = runner.TestRunner(sqlite_config, failed_first=True)
+    batches = test_runner.queue(test_runner.gather_test_cases())
+
+    failing = test_runner.history.failing
+    assert [x.test_cases[0].id in failing for x in batches] == [True] * 3 + [False] * 3
+
+    result = runner.TestRunner(sqlite_config, failed_first=True, max_failures=3).run()
+    assert (result.tested, result.failed) == (3, 3)
+
+
+def test_runner_preflight_passes_enforced_tests(sqlite_config):
+    db_path = sqlite_config.source.url.removeprefix("sqlite:///")
+    with sqlite3.connect(db_path) as db:
+        db.execute(
+            "create table places (code text not null primary key, label text unique)"
+        )
+        db.execute("insert into places values ('a', null), ('b', null)")
+    model = Model.from_obj(
+        {
+            "name": "places",
+            "schema": "main",
+            "tests": [
+                {"unique_combination_of_columns": {"columns": ["code", "label"]}}
+            ],
+            "columns": [
+                {"name": "code", "tests": ["unique", "not_null"]},
+                # unique constraints allow repeated nulls
+                {"name": "label", "tests": ["unique"]},
+            ],
+        }
+    )
+    sqlite_config.models.append(model)
+
+    test_runner = runner.TestRunner(sqlite_config, preflight=True)
+    test_cases = run_test_cases(test_runner)
+    result = runner.RunResult()
+    for test_case in test_cases:
+        result.add(test_case)
+
+    statuses = {x.name: x.status for x in test_cases if x.model is model}
+    assert statuses == {
+        "main.places: unique_combination_of_columns": "constraint",
+        "main.places.code: unique": "constraint",
+        "main.places.code: not_null": "constraint",
+        "main.places.label: unique": "fail",
+    }
+    assert (result.passed, result.enforced, result.failed) == (6, 3, 4)
+
+
+def test_runner_preflight_ignores_partial_unique_indexes(sqlite_config):
+    db_path = sqlite_config.source.url.removeprefix("sqlite:///")
+    with sqlite3.connect(db_path) as db:
+        db.execute("create table flags (id integer not null, active integer)")
+        db.execute("create unique index ux_flags on flags (id) where active = 1")
+        db.execute("insert into flags values (1, 1), (1, 0)")
+    sqlite_config.models = [
+        Model.from_obj(
+            {
+                "name": "flags",
+                "schema": "main",
+                "columns": [{"name": "id", "tests": ["unique"]}],
+            }
+        )
+    ]
+
+    (test_case,) = run_test_cases(runner.TestRunner(sqlite_config, preflight=True))
+
+    assert test_case.status == "fail"
+
+
+@pytest.mark.parametrize("fuse", [False, True])
+def test_runner_shares_results_of_duplicate_tests(sqlite_config, capsys, fuse):
+    model = sqlite_config.models[0]
+    model.columns[0].tests.append(ModelTest("unique"))
+    # the same condition as the status column's expression_is_true test
+    model.tests.append(
+        ModelTest("expression_is_true", {"expression": "length(status) = 1"})
+    )
+
+    test_runner = runner.TestRunner(sqlite_config, fuse=fuse)
+    test_cases = run_test_cases(test_runner)
+
+    duplicates = [x for x in test_cases if x.duplicate_of is not None]
+    assert [(x.name, x.status) for x in duplicates] == [
+        ("main.people.id: unique", "fail"),
+        ("main.people.status: expression_is_true", "pass"),
+    ]
+    assert all(x.timings.started_at is None for x in duplicates)
+    assert "Found 2 duplicate tests" in capsys.readouterr().out
+
+
+def test_runner_doesnt_share_results_across_settings(sqlite_config):
+    model = sqlite_config.models[0]
+    model.columns[0].tests.append(ModelTest("unique", approximate=True))
+
+    test_cases = runner.TestRunner(sqlite_config).gather_test_cases()
+    distinct = runner.TestRunner(sqlite_config).dedupe(test_cases)
+
+    assert distinct == test_cases
+
+
+def test_runner_source_pool_settings(sqlite_config):
+    source = sqlite_config.source
+    source.pool_size = 3
+    source.arraysize = 250
+    source.session_init = ["create temp table session_flag as select 1 as x"]
+    source.kwargs = {"pool_timeout": 5}
+
+    engine = runner.TestRunner(sqlite_config, threads=8).engine
+
+    assert engine.pool.size() == 3
+    assert engine.pool._timeout == 5
+    with engine.connect() as db:
+        result = db.execute(sa.text("select x from temp.session_flag"))
+        assert result.cursor.arraysize == 250
+        assert result.scalar() == 1
+
+
+@pytest.mark.parametrize("fuse", [False, True])
+def test_runner_partitioned_model(sqlite_config, fuse):
+    expected = run_test_cases(runner.TestRunner(sqlite_config))
+    model = sqlite_config.models[0]
+    model.partition_by = PartitionBy(column="id", bounds=[2, 3])
+    model.parallel = 4
+
+    test_runner = runner.TestRunner(sqlite_config, fuse=fuse, threads=2)
+    test_cases = test_runner.gather_test_cases()
+    completed = list(test_runner.execute(test_cases))
+
+    assert sorted(x.name for x in completed) == sorted(x.name for x in test_cases)
+    assert [(x.status, x.failures) for x in test_cases] == [
+        (x.status, x.failures) for x in expected
+    ]
+    # row-level tests run once per slice: 3 ranges of ids and the null ids
+    not_null = test_cases[1]
+    assert len(test_runner._slices[id(not_null)]) == 4
+    assert "/*+ parallel(4) */" in test_runner.compile(not_null).sql
+
+
+def test_runner_partition_discovery_needs_oracle(sqlite_config, capsys):
+    expected = run_test_cases(runner.TestRunner(sqlite_config))
+    model = sqlite_config.models[0]
+    model.partition_by = PartitionBy(discover=True)
+
+    test_runner = runner.TestRunner(sqlite_config)
+    with pytest.raises(ValueError, match="only supported on oracle"):
+        partitions.discover_slices(test_runner.engine, model)
+    test_cases = run_test_cases(test_runner)
+
+    # the tests run against the whole table instead
+    assert [(x.status, x.failures) for x in test_cases] == [
+        (x.status, x.failures) for x in expected
+    ]
+    assert "only supported on oracle" in capsys.readouterr().out
+
+
+def test_runner_batches_relationships_by_target(sqlite_config):
+    db_path = sqlite_config.source.url.removeprefix("sqlite:///")
+    with sqlite3.connect(db_path) as db:
+        db.execute("create table ids (id integer)")
+        db.execute("insert into ids values (1), (2)")
+        db.execute("create table pets (owner_id integer)")
+        db.execute("insert into pets values (1), (5), (null)")
+    relationship = {"relationships": {"to": "main.ids", "field": "id"}}
+    sqlite_config.models[0].columns[0].tests.append(ModelTest.from_obj(relationship))
+    sqlite_config.models.append(
+        Model.from_obj(
+            {
+                "name": "pets",
+                "schema": "main",
+                "columns": [{"name": "owner_id", "tests": [relationship]}],
+            }
+        )
+    )
+
+    test_runner = runner.TestRunner(sqlite_config, fuse=True)
+    batches = test_runner.plan(test_runner.gather_test_cases())
+    [related] = [x for x in batches if x.kind == "related"]
+    assert len(related.test_cases) == 2
+
+    test_cases = run_test_cases(test_runner)
+    expected = run_test_cases(runner.TestRunner(sqlite_config))
+    assert [x.failures for x in test_cases] == [x.failures for x in expected]
+    # the two people with id 3 and the pet owned by 5
+    failures = {
+        x.name: x.failures for x in test_cases if x.test.name == "relationships"
+    }
+    assert failures == {
+        "main.people.id: relationships": 2,
+        "main.pets.owner_id: relationships": 1,
+    }
+
+
+class ExactEstimate:
+    """A stand-in for approx_count_distinct that happens to be exact"""
+
+    factor = 1.0
+
+    def __init__(self):
+        self.values = set()
+
+    def step(self, value):
+        if value is not None:
+            self.values.add(value)
+
+    def finalize(self):
+        return len(self.values) * self.factor
+
+
+class OvershootingEstimate(ExactEstimate):
+    """A stand-in for approx_count_distinct whose estimates are 10% too high"""
+
+    factor = 1.1
+
+
+class UndershootingEstimate(ExactEstimate):
+    """A stand-in for approx_count_distinct whose estimates are 10% too low"""
+
+    factor = 0.9
+
+
+@pytest.mark.parametrize(
+    "estimate, margin, approximate",
+    [
+        (ExactEstimate, 0.0, True),
+        (OvershootingEstimate, 0.0, True),
+        (UndershootingEstimate, 0.0, False),
+        (UndershootingEstimate, 0.1, False),
+        # within the margin of the row count, so checked exactly
+        (ExactEstimate, 0.05, False),
+        (OvershootingEstimate, 0.05, True),
+    ],
+)
+def test_runner_approximate_margin(
+    sqlite_config, monkeypatch, estimate, margin, approximate
+):
+    monkeypatch.setitem(funcs.APPROX_COUNT_DISTINCT, "sqlite", "approx_count_distinct")
+    url = sqlite_config.source.url.removeprefix("sqlite:///")
+    with sqlite3.connect(url) as db:
+        db.execute("create table ids (id integer)")
+        db.executemany("insert into ids values (?)", [(x,) for x in range(1000)])
+    sqlite_config.models = [
+        Model.from_obj(
+            {
+                "name": "ids",
+                "schema": "main",
+                "columns": [{"name": "id", "tests": ["unique"]}],
+            }
+        )
+    ]
+
+    test_runner = runner.TestRunner(
+        sqlite_config, approximate=True, approximate_margin=margin
+    )
+    sa.event.listen(
+        test_runner.engine,
+        "connect",
+        lambda conn, _: conn.create_aggregate("approx_count_distinct", 1, estimate),
+    )
+    (test_case,) = run_test_cases(test_runner)
+
+    assert test_case.passed
+    assert test_case.approximate == approximate
+
+
+def test_runner_approximate_unique(sqlite_config, monkeypatch):
+    monkeypatch.setitem(funcs.APPROX_COUNT_DISTINCT, "sqlite", "approx_count_distinct")
+    model = sqlite_config.models[0]
+    model.columns[1].tests.append(ModelTest("unique"))
+    model.tests.append(
+        ModelTest("unique_combination_of_columns", {"columns": ["id", "status"]})
+    )
+
+    test_runner = runner.TestRunner(sqlite_config, approximate=True)
+    sa.event.listen(
+        test_runner.engine,
+        "connect",
+        lambda conn, _: conn.create_aggregate(
+            "approx_count_distinct", 1, OvershootingEstimate
+        ),
+    )
+    test_cases = {x.name: x for x in run_test_cases(test_runner)}
+
+    # one null and three distinct names: passed on the estimate alone
+    assert test_cases["main.people.name: unique"].approximate
+    assert test_cases["main.people.name: unique"].passed
+    assert test_cases["main.people: unique_combination_of_columns"].approximate
+    # the estimate of 3 distinct ids in 4 rows suggests duplicates
+    assert not test_cases["main.people.id: unique"].approximate
+    assert test_cases["main.people.id: unique"].failures == 1
+
+
+@pytest.mark.parametrize("fuse", [False, True])
+def test_runner_materializes_view_once(sqlite_config, fuse):
+    expected = run_test_cases(runner.TestRunner(sqlite_config, fuse=fuse))
+    db_path = sqlite_config.source.url.removeprefix("sqlite:///")
+    with sqlite3.connect(db_path) as db:
+        db.execute("create view people_v as select * from people")
+    model = sqlite_config.models[0]
+    model.name = "people_v"
+    model.materialize = "temp"
+
+    test_runner = runner.TestRunner(sqlite_config, fuse=fuse, threads=2)
+    statements = []
+    sa.event.listen(
+        test_runner.engine,
+        "before_cursor_execute",
+        lambda conn, cursor, sql, *args: statements.append(sql),
+    )
+    test_cases = run_test_cases(test_runner)
+
+    assert [(x.status, x.failures) for x in test_cases] == [
+        (x.status, x.failures) for x in expected
+    ]
+    assert all(x.relation is None for x in test_cases)
+    creates = [x for x in statements if x.startswith("create temporary table")]
+    assert len(creates) == 1
+    assert all("people_v" not in x for x in statements if x not in creates)
+
+
+def test_runner_materialize_unsupported_dialect(sqlite_config, monkeypatch, capsys):
+    expected = run_test_cases(runner.TestRunner(sqlite_config))
+    monkeypatch.delitem(materialize.TEMP_TABLES, "sqlite")
+    sqlite_config.models[0].materialize = "temp"
+
+    test_cases = run_test_cases(runner.TestRunner(sqlite_config))
+
+    assert [(x.status, x.failures) for x in test_cases] == [
+        (x.status, x.failures) for x in expected
+    ]
+    assert "temporary tables aren't supported on sqlite" in capsys.readouterr().out
+
+
+def test_test_case_memoizes_query(sqlite_config):
+    test_runner = runner.TestRunner(sqlite_config)
+    test_cases = test_runner.iter_test_cases(["people"])
+    test_case = next(test_cases)
+
+    query = test_case.query
+    assert test_case.query is query
+    assert not hasattr(test_case, "__dict__")
+
+    test_case.relation = "(select * from main.people where id > :low)"
+    test_case.relation_params = {"low": 1}
+    scoped = test_case.query
+    assert scoped is not query
+    assert "id > :low" in scoped.sql and scoped.params["low"] == 1
+    test_case.relation_params["low"] = 2
+    assert test_case.query.params["low"] == 2
+
+    test_case.release()
+    assert test_case.result is None
+    assert test_case.query is not scoped
+    assert len(list(test_cases)) == 5
@@ -0,0 +1,53 @@
+import pytest
+
+from sqltest import runner, scheduling
+from sqltest.models import Model, ModelTest
+
+
+def make_batch(model, name):
+    test = ModelTest(name=name, kwargs={})
+    return runner.Batch([runner.TestCase(model=model, column=None, test=test)])
+
+
+def test_longest_first():
+    model = Model(name="people", schema="main")
+    fast, slow, new = [make_batch(model, x) for x in ("fast", "slow", "new")]
+    durations = {fast.test_cases[0].id: 1.0, slow.test_cases[0].id: 5.0}
+
+    ordered = scheduling.longest_first([fast, new, slow], durations)
+
+    # untested batches are expected to take the average duration
+    assert ordered == [slow, new, fast]
+
+
+def test_dispatcher_caps_batches_per_model():
+    people = Model(name="people", schema="main")
+    places = Model(name="places", schema="main")
+    first, second = make_batch(people, "a"), make_batch(people, "b")
+    other = make_batch(places, "c")
+    dispatcher = scheduling.Dispatcher([first, second, other], max_per_model=1)
+
+    assert dispatcher.next() is first
+    assert dispatcher.next() is other
+    assert dispatcher.next() is None
+    assert dispatcher
+
+    dispatcher.done(first)
+    assert dispatcher.next() is second
+    assert not dispatcher
+
+
+@pytest.mark.parametrize("balanced", [False, True])
+def test_shards_split_every_test_once(sqlite_config, balanced):
+    test_runner = runner.TestRunner(sqlite_config)
+    test_runner.run()
+    test_cases = test_runner.gather_test_cases()
+    durations = test_runner.history.durations if balanced else None
+
+    shards = [scheduling.shard(test_cases, i, 3, durations) for i in (1, 2, 3)]
+
+    ids = sorted(x.id for shard in shards for x in shard)
+    assert ids == sorted(x.id for x in test_cases)
+    if balanced:
+        loads = [sum(durations[x.id] for x in shard) for shard in shards]
+        assert max(loads) - min(loads) <= max(durations.values())
@@ -0,0 +1,140 @@
+import sqlite3
+
+import pytest
+import yaml
+
+from sqltest.models import Config
+from sqltest import runner
+
+
+@pytest.fixture
+def config():
+    def model(name, schema, tags=(), parent=None):
+        columns = [{"name": "id", "tests": ["unique"]}]
+        if parent is not None:
+            relationship = {"relationships": {"to": parent, "field": "id"}}
+            columns.append({"name": "parent_id", "tests": [relationship]})
+        return {"name": name, "schema": schema, "tags": list(tags), "columns": columns}
+
+    obj = {
+        "source": {"name": "foo", "url": "foodriver://foo.com:1234"},
+        "models": [
+            model("departments", "findw", tags=["nightly"]),
+            model("employees", "findw", parent="findw.departments"),
+            model("payroll", "hr", tags=["nightly"], parent="employees"),
+            model("students", "sisdw"),
+        ],
+    }
+    return Config.from_obj(obj)
+
+
+@pytest.mark.parametrize(
+    "selectors, expected",
+    [
+        (["students"], ["students"]),
+        (["HR.Payroll"], ["payroll"]),
+        (["schema:findw"], ["departments", "employees"]),
+        (["tag:nightly"], ["departments", "payroll"]),
+        (["+employees"], ["departments", "employees", "payroll"]),
+        (["+departments", "students"], ["departments", "employees", "students"]),
+        (["test:relationships"], ["employees", "payroll"]),
+        (["missing"], []),
+    ],
+)
+def test_registry_select(config, selectors, expected):
+    selected = config.registry.select(selectors)
+    assert [x.name for x, _ in selected] == expected
+
+
+def test_registry_select_tests(config):
+    selected = config.registry.select(["test:relationships", "tag:nightly"])
+    assert [(x.name, tests) for x, tests in selected] == [
+        ("departments", None),
+        ("employees", {"relationships"}),
+        ("payroll", None),
+    ]
+
+    test_cases = runner.TestRunner(config).gather_test_cases(
+        ["test:unique", "schema:hr"]
+    )
+    assert [x.name for x in test_cases] == [
+        "findw.departments.id: unique",
+        "findw.employees.id: unique",
+        "hr.payroll.id: unique",
+        "hr.payroll.parent_id: relationships",
+        "sisdw.students.id: unique",
+    ]
+
+
+def test_registry_unknown_selector(config):
+    with pytest.raises(ValueError):
+        config.registry.select(["owner:me"])
+    with pytest.raises(ValueError):
+        config.select_model("missing")
+    assert config.select_model("EMPLOYEES") is config.models[1]
+
+
+def test_registry_state_modified(tmp_path):
+    db_path = tmp_path / "test.db"
+    with sqlite3.connect(db_path) as db:
+        for name in ("model_a", "model_b"):
+            db.execute(f"create table {name} (id integer)")
+            db.execute(f"insert into {name} values (1)")
+    models_dir = tmp_path / "models"
+    models_dir.mkdir()
+    for name in ("model_a", "model_b"):
+        (models_dir / f"{name}.yml").write_text(model_yaml(name, ["not_null"]))
+    obj = {
+        "source": {"name": "foo", "url": f"sqlite:///{db_path}"},
+        "models_dir": str(models_dir),
+        "target_dir": str(tmp_path / ".sqltest"),
+    }
+
+    def modified(**kwargs):
+        test_runner = runner.TestRunner(Config.from_obj(obj), **kwargs)
+        test_cases = test_runner.gather_test_cases(["state:modified"])
+        return test_runner, sorted({x.model.name for x in test_cases})
+
+    test_runner, names = modified()
+    assert names == ["model_a", "model_b"]
+    assert test_runner.run(["state:modified"]).success
+    # loading the config, as `sqltest parse` does, doesn't change the state
+    Config.from_obj(obj)
+    assert modified()[1] == []
+
+    saved = tmp_path / "saved.pickle"
+    (tmp_path / ".sqltest" / "state.pickle").rename(saved)
+    modified()[0].run()
+
+    # a model stays modified until its tests pass
+    failing = model_yaml("model_b", [{"accepted_values": {"values": [2]}}])
+    (models_dir / "model_b.yml").write_text(failing)
+    Config.from_obj(obj)
+    test_runner, names = modified()
+    assert names == ["model_b"]
+    assert not test_runner.run(["state:modified"]).success
+    assert modified()[1] == ["model_b"]
+
+    # a given state is compared against but never updated
+    (models_dir / "model_b.yml").write_text(model_yaml("model_b", ["unique"]))
+    test_runner, names = modified(state=saved)
+    assert names == ["model_b"]
+    contents = saved.read_bytes()
+    assert test_runner.run().success
+    assert saved.read_bytes() == contents
+    assert modified(state=saved)[1] == ["model_b"]
+
+    with pytest.raises(ValueError):
+        Config.from_obj(obj).registry.select(["state:modified"])
+
+    # a given state that can't be read isn't taken for an empty one
+    with pytest.raises(ValueError):
+        modified(state=tmp_path / "missing.pickle")
+    (tmp_path / "corrupt.pickle").write_bytes(b"not a pickle")
+    with pytest.raises(ValueError):
+        modified(state=tmp_path / "corrupt.pickle")
+
+
+def model_yaml(name, tests):
+    columns = [{"name": "id", "tests": tests}]
+    return yaml.safe_dump({"name": name, "schema": "main", "columns": columns})